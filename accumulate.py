@@ -0,0 +1,117 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Running accumulators over consecutive frames, for scope style averaging,
+# envelope and infinite persistence displays.
+#
+# Each frame updates the accumulators in place with O(samples) work and no
+# frame is kept, so memory stays at a few frames' worth (one histogram for
+# persistence) however long they run. A frame of another shape (record
+# length or channels changed) starts a new accumulation.
+
+Stats = namedtuple('Stats', ['count', 'mean', 'std', 'low', 'high'])
+
+
+class RunningStats:
+    # Welford mean and variance, and min/max envelope, of every sample
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.mean = None
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.mean = None
+
+    def add(self, y):
+        with self.lock:
+            if self.mean is None or self.mean.shape != y.shape:
+                self.count = 0
+                self.mean = np.zeros(y.shape)
+                self.m2 = np.zeros(y.shape)
+                self.delta = np.empty(y.shape)
+                self.scratch = np.empty(y.shape)
+                self.low = np.array(y, dtype=np.float32)
+                self.high = np.array(y, dtype=np.float32)
+            else:
+                np.minimum(self.low, y, out=self.low)
+                np.maximum(self.high, y, out=self.high)
+            self.count += 1
+            np.subtract(y, self.mean, out=self.delta)
+            np.multiply(self.delta, 1.0 / self.count, out=self.scratch)
+            self.mean += self.scratch
+            np.subtract(y, self.mean, out=self.scratch)
+            self.scratch *= self.delta
+            self.m2 += self.scratch
+            return self.count
+
+    def latest(self):
+        # Stats copied out, None before the first frame
+        with self.lock:
+            if self.mean is None:
+                return None
+            variance = self.m2 / max(self.count - 1, 1)
+            return Stats(self.count, self.mean.astype(np.float32),
+                         np.sqrt(variance).astype(np.float32),
+                         self.low.copy(), self.high.copy())
+
+
+class Persistence:
+    # Hit counts of every (voltage bin, sample) cell over all frames, every
+    # channel of a stack drawn into the same map. The voltage range is set
+    # by the first frame with a margin; samples outside land in the edge bins.
+    def __init__(self, bins=128, margin=0.25):
+        self.bins = bins
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.counts = None
+
+    def reset(self):
+        with self.lock:
+            self.counts = None
+
+    def add(self, y):
+        y = np.atleast_2d(y)
+        points = y.shape[1]
+        with self.lock:
+            if self.counts is None or self.counts.shape[1] != points \
+                    or len(y) != self.channels:
+                low, high = float(y.min()), float(y.max())
+                pad = self.margin * (high - low) or 1.0
+                self.low, self.high = low - pad, high + pad
+                self.counts = np.zeros((self.bins, points), dtype=np.uint32)
+                self.columns = np.arange(points)
+                self.scaled = np.empty(points)
+                self.cells = np.empty(points, dtype=np.intp)
+                self.channels = len(y)
+                self.frames = 0
+            flat = self.counts.reshape(-1)
+            step = self.bins / (self.high - self.low)
+            for row in y:
+                # one cell per column, so the fancy index has no repeats
+                np.subtract(row, self.low, out=self.scaled)
+                self.scaled *= step
+                np.copyto(self.cells, self.scaled, casting='unsafe')
+                np.clip(self.cells, 0, self.bins - 1, out=self.cells)
+                self.cells *= points
+                self.cells += self.columns
+                flat[self.cells] += 1
+            self.frames += 1
+            return self.frames
+
+    def latest(self, columns=None):
+        # (voltage of each bin, counts, first sample of each count column)
+        # with the sample axis summed down to at most columns, None before
+        # the first frame
+        with self.lock:
+            if self.counts is None:
+                return None
+            centers = self.low + (np.arange(self.bins) + 0.5) * (self.high - self.low) / self.bins
+            points = self.counts.shape[1]
+            if columns is None or points <= columns:
+                return centers, self.counts.copy(), np.arange(points)
+            starts = np.arange(0, points, -(-points // columns))
+            return centers, np.add.reduceat(self.counts, starts, axis=1), starts
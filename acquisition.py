@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import measure
+import offload
+
+# Background acquisition decoupled from the Dash callbacks.
+#
+# A single thread per process polls the instrument and writes each waveform
+# into a preallocated ring of frames; callbacks only copy the latest frame
+# out, so any number of viewers cost one acquisition per cycle. The
+# measurements of each frame are computed off the callbacks as well, in the
+# offload pool when there is one.
+
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'x', 'y', 'measurements'])
+
+
+class RingBuffer:
+    def __init__(self, capacity=8):
+        # capacity >= 2 so the slot being filled is never the latest frame
+        self.capacity = max(2, capacity)
+        self.lock = threading.Lock()
+        self.data = None
+        self.x = [None] * self.capacity
+        self.measurements = [None] * self.capacity
+        self.timestamps = np.zeros(self.capacity)
+        self.seq = 0
+
+    def slot(self):
+        # buffer the next frame is acquired into, None before the first frame
+        with self.lock:
+            if self.data is None:
+                return None
+            return self.data[self.seq % self.capacity]
+
+    def commit(self, x, y, timestamp=None, measurements=None):
+        with self.lock:
+            if self.data is None or self.data.shape[1:] != y.shape:
+                # record length changed; frames of the old length are dropped
+                self.data = np.empty((self.capacity,) + y.shape, dtype=np.float32)
+            index = self.seq % self.capacity
+            if not np.shares_memory(y, self.data[index]):
+                self.data[index] = y
+            self.x[index] = x
+            self.measurements[index] = measurements
+            self.timestamps[index] = time.time() if timestamp is None else timestamp
+            self.seq += 1
+            return self.seq
+
+    def latest(self):
+        with self.lock:
+            if self.seq == 0:
+                return None
+            index = (self.seq - 1) % self.capacity
+            return Frame(self.seq, self.timestamps[index], self.x[index],
+                         self.data[index].copy(), self.measurements[index])
+
+
+class AcquisitionLoop:
+    def __init__(self, acquire, interval=1.0, capacity=8):
+        # acquire(out) -> (x, y), writing y into out when it fits
+        self.acquire = acquire
+        self.interval = interval
+        self.ring = RingBuffer(capacity)
+        self.error = None
+        # called with each new Frame on the acquisition thread
+        self.listeners = []
+        # notified after the listeners of each new frame, see wait();
+        # notified is the last frame they have seen
+        self.updated = threading.Condition()
+        self.notified = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopped.clear()
+                self.thread = threading.Thread(target=self.run, name='acquisition',
+                                               daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            try:
+                x, y = self.acquire(out=self.ring.slot())
+            except Exception as error:
+                if self.error is None:
+                    print("ERROR: acquisition failed: {}".format(error))
+                self.error = error
+            else:
+                self.error = None
+                measurements = offload.run(measure.measure, x, y)
+                self.ring.commit(x, y, measurements=measurements)
+                self.notify()
+            self.stopped.wait(max(0.0, self.interval - (time.time() - started)))
+
+    def notify(self):
+        frame = self.ring.latest()
+        for listener in list(self.listeners):
+            try:
+                listener(frame)
+            except Exception as error:
+                print("ERROR: acquisition listener failed: {}".format(error))
+        with self.updated:
+            self.notified = frame
+            self.updated.notify_all()
+
+    def wait(self, seq=0, timeout=None):
+        # first frame newer than seq once every listener has seen it, or
+        # None when none arrives in timeout
+        self.start()
+        with self.updated:
+            self.updated.wait_for(
+                lambda: self.notified is not None and self.notified.seq > seq, timeout)
+            frame = self.notified
+        if frame is None or frame.seq <= seq:
+            return None
+        return frame
+
+    def latest(self):
+        self.start()
+        return self.ring.latest()
@@ -1,19 +1,32 @@
 import dash
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
 import dash_html_components as html
 import dash_core_components as dcc
 import dash_daq as daq
 
 import plotly.graph_objs as go
-from time import sleep
+import flask
+import json
 import os
+import threading
 import numpy as np
 
+import accumulate
+import acquisition
+import capture_log
+import decimate
+import measure
+import offload
+import run_store
+import spectrum
+import transport
+from cache import LRUCache
 import fgen_afg3021 as fgen
 import osc_tds350 as osc
 
 
-app = dash.Dash()
+app = dash.Dash(__name__)
 
 app.config['suppress_callback_exceptions'] = True
 
@@ -23,331 +36,172 @@ tabs = [
     {'label': 'Run #{}'.format(i), 'value': i} for i in range(1, 2)
 ]
 
-tab = 1
-
-runs = {}
-
-fgen.open_port()
-
-app.layout = html.Div(id='container', children=[
-    # Function Generator Panel - Left
-    html.Div([
-        html.H2("Dash DAQ: Function Generator & Oscilloscope Control Panel",
-                style={'marginLeft': '40px'}),
-        html.Img(src="https://s3-us-west-1.amazonaws.com/plotly-tutorials/" +
-                 "excel/dash-daq/dash-daq-logo-by-plotly-stripe+copy.png")
-    ], className='banner', id='header'),
-
-    html.Div([
-        html.Div([
-            html.Div([
-                html.H3("POWER", id="power-title")
-            ], className='Title'),
-            html.Div([
-                html.Div([
-                    daq.PowerButton(
-                        id='function-generator',
-                        on='true',
-                        label="Function Generator",
-                        labelPosition='bottom',
-                        color="#447EFF"),
-                ], className='six columns', style={'margin-bottom': '15px'}),
-                html.Div([
-                    daq.PowerButton(
-                        id='oscilloscope',
-                        on='true',
-                        label="Oscilloscope",
-                        labelPosition='bottom',
-                        color="#447EFF")
-                ], className='six columns', style={'margin-bottom': '15px'}),
-            ], style={'margin': '15px 0'})
-        ], className='row power-settings-tab'),
-        html.Div([
-            html.Div(
-                [html.H3("FUNCTION", id="function-title")],
-                className='Title'),
-            html.Div([
-                daq.Knob(
-                    value=fgen.get_frequency(),
-                    id="frequency-input",
-                    label="Frequency (Hz)",
-                    labelPosition="bottom",
-                    size=75,
-                    color="#447EFF",
-                    scale={'interval': 1E5},
-                    max=2.5E6,
-                    min=1E5,
-                    className='four columns'
-                ),
-                daq.Knob(
-                    value=fgen.get_amplitude(),
-                    id="amplitude-input",
-                    label="Amplitude (mV)",
-                    labelPosition="bottom",
-                    size=75,
-                    scale={'labelInterval': 10},
-                    color="#447EFF",
-                    max=10,
-                    className='four columns'
-                ),
-                daq.Knob(
-                    value=fgen.get_offset(),
-                    id="offset-input",
-                    label="Offset (mV)",
-                    labelPosition="bottom",
-                    size=75,
-                    scale={'labelInterval': 10},
-                    color="#447EFF",
-                    max=10,
-                    className='four columns'
-                )], style={'marginLeft': '20%', 'textAlign': 'center'}),
-            html.Div([
-                daq.LEDDisplay(
-                    id='frequency-display',
-                    size=10,
-                    label="Frequency (Hz)",
-                    labelPosition="bottom",
-                    color="#447EFF",
-                    style={'marginBottom': '30px'},
-                    className='four columns'),
-                daq.LEDDisplay(
-                    id='frequency-display',
-                    size=10,
-                    label="Amplitude (mV)",
-                    labelPosition="bottom",
-                    color="#447EFF",
-                    className='four columns'),
-                daq.LEDDisplay(
-                    id='offset-display',
-                    size=10,
-                    label="Offset (mV)",
-                    labelPosition="bottom",
-                    color="#447EFF",
-                    className='four columns'),
-            ], style={'marginLeft': '20%', 'textAlign': 'center'}),
-            dcc.RadioItems(
-                id='function_type',
-                options=[
-                    {'label': 'Sine', 'value': 'SIN'},
-                    {'label': 'Square', 'value': 'SQUARE'},
-                    {'label': 'Ramp', 'value': 'RAMP'},
-                ],
-                value='SIN',
-                labelStyle={'display': 'inline-block'},
-                style={'margin': '30px auto 0px auto',
-                       'display': 'flex',
-                       'width': '80%',
-                       'alignItems': 'center',
-                       'justifyContent': 'space-between'}
-                )
-            ], className='row power-settings-tab'),
-        html.Hr(),
-        daq.ColorPicker(
-            id="color-picker",
-            label="Color Picker",
-            value=dict(hex="#447EFF"),
-            size=164,
-            theme={'dark': True}
-        ),
-    ], className='four columns left-panel'),
-
-    # Oscillator Panel - Right
-    html.Div([
-        html.Div([html.H3("GRAPH", id="graph-title")], className='Title'),
-        dcc.Tabs(
-            tabs=tabs,
-            value=1,
-            id='tabs',
-            style={'backgroundColor': '#447EFF', 'height': '80%'},
-        ),
-
-        html.Div([
-            html.Div([
-                html.Div([
-                    html.Div(
-                        id="graph_info",
-                        style={
-                            'textAlign': 'center',
-                            'fontSize': '16px',
-                            'padding': '0px 5px',
-                            'lineHeight': '20px',
-                            'border': '2px solid #447EFF'}),
-                 ], className="row graph-param"),
-            ], className="six columns"),
-            html.Button('+',
-                        id='new_tab',
-                        type='submit',
-                        style={'height': '20px', 'width': '20px',
-                               'padding': '2px', 'lineHeight': '10px',
-                               'float': 'right'}),
-        ], className='row oscope-info', style={'margin': '15px'}),
-        html.Hr(),
-        dcc.Graph(
-            id='oscope-graph',
-            figure=dict(
-                data=osc.get_data(),
-                layout=go.Layout(
-                    xaxis={'title': 's', 'color': '#506784',
-                           'titlefont': dict(
-                               family='Dosis',
-                               size=15,
-                           )},
-                    yaxis={'title': 'Voltage (mV)', 'color': '#506784',
-                           'titlefont': dict(
-                               family='Dosis',
-                               size=15,
-                            ), 'autorange': False, 'range': [-10, 10]},
-                    margin={'l': 40, 'b': 40, 't': 0, 'r': 50},
-                    plot_bgcolor='#F3F6FA',
-                )
-            ),
-            config={'displayModeBar': True,
-                    'modeBarButtonsToRemove': ['pan2d',
-                                               'zoomIn2d',
-                                               'zoomOut2d',
-                                               'autoScale2d',
-                                               'hoverClosestCartesian',
-                                               'hoverCompareCartesian']}
-        )
-    ], className='seven columns right-panel'),
-    dcc.Interval(id='update-oscope', interval=2000, n_intervals=0),
-])
-
-
-# Callbacks for color picker
-@app.callback(Output('frequency-input', 'color'),
-              [Input('color-picker', 'value')])
-def color_frequency_input(color):
-    return color['hex']
-
-
-@app.callback(Output('amplitude-input', 'color'),
-              [Input('color-picker', 'value')])
-def color_amplitude_input(color):
-    return color['hex']
-
-
-@app.callback(Output('offset-input', 'color'),
-              [Input('color-picker', 'value')])
-def color_offset_input(color):
-    return color['hex']
-
-
-@app.callback(Output('frequency-display', 'color'),
-              [Input('color-picker', 'value')])
-def color_frequency_display(color):
-    return color['hex']
-
-
-@app.callback(Output('frequency-display', 'color'),
-              [Input('color-picker', 'value')])
-def color_amplitude_display(color):
-    return color['hex']
-
-
-@app.callback(Output('offset-display', 'color'),
-              [Input('color-picker', 'value')])
-def color_offset_display(color):
-    return color['hex']
-
-
-@app.callback(Output('graph_info', 'style'),
-              [Input('color-picker', 'value')])
-def color_info(color):
-    return {'textAlign': 'center', 'border': "2px solid " + color['hex']}
-
-
-@app.callback(Output('tabs', 'style'),
-              [Input('color-picker', 'value')])
-def color_tabs_background(color):
-    return {'backgroundColor': color['hex']}
-
 
-@app.callback(Output('power-title', 'style'),
-              [Input('color-picker', 'value')])
-def color_power_title(color):
-    return {'color': color['hex']}
+def tab_components():
+    return [dcc.Tab(label=t['label'], value=t['value']) for t in tabs]
 
 
-@app.callback(Output('function-title', 'style'),
-              [Input('color-picker', 'value')])
-def color_function_title(color):
-    return {'color': color['hex']}
-
-
-@app.callback(Output('graph-title', 'style'),
-              [Input('color-picker', 'value')])
-def color_graph_title(color):
-    return {'color': color['hex']}
-
-
-@app.callback(Output('function-generator', 'color'),
-              [Input('color-picker', 'value')])
-def color_fnct_power(color):
-    return color['hex']
-
-
-@app.callback(Output('oscilloscope', 'color'),
-              [Input('color-picker', 'value')])
-def color_osc_power(color):
-    return color['hex']
-
+tab = 1
 
-@app.callback(Output('header', 'style'),
-              [Input('color-picker', 'value')])
-def color_banner(color):
-    return {'backgroundColor': color['hex']}
+# captured waveforms and generator settings by run (tab value), kept on disk
+# and shared by every worker
+runs = run_store.RunStore()
 
+# scope sources on oscope-graph; every channel is fetched in one round trip
+channels = ('CH1',)
 
-# Callbacks for knob inputs
-@app.callback(Output('frequency-display', 'value'),
-              [Input('frequency-input', 'value')],)
-def update_frequency_display(value):
-    fgen.set_frequency(value)
-    return value
+# capture_log.CaptureLog the raw frames are appended to while logging is on
+capture = None
 
 
-@app.callback(Output('frequency-display', 'value'),
-              [Input('amplitude-input', 'value')],)
-def update_amplitude_display(value):
-    fgen.set_amplitude(value)
-    return value
+def acquire(out=None):
+    log = capture
+    return osc.acquire_channels(channels, out,
+                                None if log is None else log.append)
 
 
-@app.callback(Output('offset-display', 'value'),
-              [Input('offset-input', 'value')])
-def update_offset_display(value):
-    fgen.set_offset(value)
-    return value
+# readers of the captures being replayed, by capture name
+replays = LRUCache(4)
 
 
-@app.callback(Output('offset-display', 'value'),
-              [Input('function_type', 'value')])
-def update_fgen_wave(value):
-    fgen.set_wave(value)
-    return value
+def replay_log(name):
+    log = replays.get_or_compute(
+        name, lambda: capture_log.CaptureLog(capture_log.capture_path(name)))
+    log.refresh()
+    return log
 
 
-# Callbacks graph and graph info
-@app.callback(Output('graph_info', 'children'),
-              [Input('oscope-graph', 'figure'),
-               Input('tabs', 'value')])
-def update_info(_, value):
-    if '' + str(value) in runs:
-        return (runs['' + str(value)][1])
-    return "-"
+def capture_options():
+    return [{'label': name, 'value': name} for name in capture_log.list_captures()]
 
 
-@app.callback(Output('oscope-graph', 'figure'),
-              [Input('update-oscope', 'n_intervals'),
-               Input('tabs', 'value')])
-def update_output(_, value):
-    global tab
-    time = np.linspace(-0.000045, 0.000045, 1e3)
-    zero = dict(
-        data=[dict(x=time, y=[0] * len(time),
-              marker={'color': '#2a3f5f'})],
-        layout=go.Layout(
+# one scope acquisition per second, shared by every viewer of this worker
+acquisition_loop = acquisition.AcquisitionLoop(acquire, interval=1.0)
+
+# oscope-graph shows the traces ('time'), their running 'average', min/max
+# 'envelope' or 'persistence' map, or their averaged 'spectrum'. Live frames
+# are accumulated on the acquisition thread, in place and without history.
+display = 'time'
+spectrum_average = spectrum.Average(count=8)
+running = accumulate.RunningStats()
+persistence = accumulate.Persistence()
+stale_relayout = None       # zoom of the previous display, not applied
+
+
+def accumulate_frame(frame):
+    if display == 'spectrum':
+        spectrum_average.add_power(*offload.run(spectrum.power, frame.x, frame.y))
+    elif display in ('average', 'envelope'):
+        running.add(frame.y)
+    elif display == 'persistence':
+        persistence.add(frame.y)
+
+
+def reset_accumulators():
+    spectrum_average.reset()
+    running.reset()
+    persistence.reset()
+
+
+def frame_names(frame):
+    return list(channels) if len(frame.y) == len(channels) else None
+
+
+# generator settings and measurements of the latest frame
+live_info = "-"
+
+
+def record_run(frame):
+    # the latest frame and its settings are kept as the run of the current tab
+    global live_info
+    names = frame_names(frame)
+    settings = {'wave': fgen.get_wave(),
+                'frequency': fgen.get_frequency(),
+                'amplitude': fgen.get_amplitude(),
+                'offset': fgen.get_offset(),
+                'channels': names}
+    info = str(settings['wave']) + " | " + \
+        str(settings['frequency']) + "Hz" + " | " + \
+        str(settings['amplitude']) + "mV" + " | " +  \
+        str(settings['offset']) + "mV"
+    for index, measurements in enumerate(frame.measurements):
+        info += " || " + measure.describe(measurements, name=names[index] if names else None)
+    runs.save(tab, settings=settings, info=info, x=frame.x, y=frame.y)
+    live_info = info
+
+
+acquisition_loop.listeners.append(accumulate_frame)
+acquisition_loop.listeners.append(record_run)
+
+# axes of each display, merged into the figure layout by the client
+axes = {
+    'time': {'xaxis': {'title': 's', 'autorange': True},
+             'yaxis': {'title': 'Voltage (mV)', 'autorange': False, 'range': [-10, 10]},
+             'uirevision': 'oscope'},
+    'persistence': {'xaxis': {'title': 's', 'autorange': True},
+                    'yaxis': {'title': 'Voltage (mV)', 'autorange': True},
+                    'uirevision': 'persistence'},
+    'spectrum': {'xaxis': {'title': 'Hz', 'autorange': True},
+                 'yaxis': {'title': 'dBV', 'autorange': True},
+                 'uirevision': 'spectrum'},
+}
+
+
+def run_frame(x, y, relayout=None, names=None, layout=axes['time']):
+    # only the visible window is sent, reduced to min/max pairs per pixel
+    # when that is smaller: the pairs need an x value each, while the whole
+    # window of an evenly spaced axis is sent as y alone
+    x_range = decimate.x_range(relayout)
+    visible = decimate.window(x, x_range)
+    samples = visible.stop - visible.start
+    if samples <= 4 * decimate.DEFAULT_WIDTH and transport.axis_step(x[visible]) is not None:
+        return transport.frame_payload(x[visible], y[..., visible], names=names, layout=layout)
+    x, y = decimate.decimate(x, y, x_range)
+    return transport.frame_payload(x, y, names=names, layout=layout)
+
+
+def display_frame(x, y, relayout=None, names=None):
+    # frame of a stored or replayed trace in the selected display
+    if display == 'spectrum':
+        f, decibels = offload.run(spectrum.spectrum, x, y)
+        return run_frame(f, decibels, relayout, names, layout=axes['spectrum'])
+    return run_frame(x, y, relayout, names)
+
+
+def live_frame(frame, relayout=None, names=None):
+    # latest frame through the accumulator of the selected display
+    if display == 'spectrum':
+        average = spectrum_average.latest()
+        if average is not None:
+            return run_frame(*average, relayout, names, layout=axes['spectrum'])
+    elif display == 'average':
+        stats = running.latest()
+        if stats is not None and stats.mean.shape == frame.y.shape:
+            return run_frame(frame.x, stats.mean, relayout, names)
+    elif display == 'envelope':
+        stats = running.latest()
+        if stats is not None and stats.low.shape == frame.y.shape:
+            names = names or ['CH{}'.format(row + 1) for row in range(len(frame.y))]
+            return run_frame(frame.x, np.concatenate([stats.low, stats.high]), relayout,
+                             [name + ' min' for name in names] +
+                             [name + ' max' for name in names])
+    elif display == 'persistence':
+        # hit counts on a log scale, summed to one column per two pixels
+        result = persistence.latest(decimate.DEFAULT_WIDTH // 2)
+        if result is not None and result[2][-1] < len(frame.x):
+            centers, counts, starts = result
+            return transport.frame_payload(frame.x[starts], np.log1p(counts),
+                                           bins=transport.encode_axis(centers),
+                                           layout=axes['persistence'])
+    return display_frame(frame.x, frame.y, relayout, names)
+
+
+def run_figure(x, y):
+    # full figure for the initial page; later updates only send frames
+    x, y = decimate.decimate(x, y)
+    return {
+        'data': osc.trace(x, y),
+        'layout': go.Layout(
             xaxis={'title': 's', 'color': '#506784',
                    'titlefont': dict(
                        family='Dosis',
@@ -357,56 +211,501 @@ def update_output(_, value):
                    'titlefont': dict(
                        family='Dosis',
                        size=15,
-                   )},
+                   ), 'autorange': False, 'range': [-10, 10]},
             margin={'l': 40, 'b': 40, 't': 0, 'r': 50},
             plot_bgcolor='#F3F6FA',
-        )
-    )
+            uirevision='oscope')
+    }
+
+
+zero_time = np.linspace(-0.000045, 0.000045, 1000)
+zero_frame = transport.frame_payload(zero_time, np.zeros(1000), layout=axes['time'])
+
+
+def replay_frame(name, seconds, relayout=None):
+    # frame of a capture shown at the replay slider position (seconds from
+    # its first frame); the samples are read from the mapped capture file
+    log = replay_log(name)
+    if not len(log):
+        return zero_frame
+    position = log.seek(log.timestamps()[0] + (seconds or 0))
+    _, x, y = log.frame(position)
+    return display_frame(x, y, relayout, log.sources(position))
+
+
+def overview_figure(log):
+    # envelope of every channel over the whole capture, from overview.bin
+    # and its pyramids
+    times, low, high = log.overview()
+    seconds = times - times[0]
+    data = []
+    for column, name in enumerate(log.sources(-1)):
+        for side, envelope, fill in ((0, low, None), (1, high, 'tonexty')):
+            x, y = decimate.decimate(seconds, envelope[:, column],
+                                     levels=log.levels[column][side])
+            data.append({'x': x, 'y': y, 'name': name, 'mode': 'lines',
+                         'line': {'width': 1}, 'fill': fill})
+    return {'data': data,
+            'layout': go.Layout(xaxis={'title': 's', 'color': '#506784'},
+                                yaxis={'color': '#506784'},
+                                margin={'l': 40, 'b': 30, 't': 0, 'r': 50},
+                                height=120,
+                                showlegend=False,
+                                plot_bgcolor='#F3F6FA')}
+
+
+def initial_figure():
+    # latest frame or stored run; never waits for the oscilloscope
+    frame = acquisition_loop.ring.latest()
+    if frame is not None:
+        return run_figure(frame.x, frame.y)
+    run = runs.load(tab)
+    if run is not None and run.y is not None:
+        return run_figure(run.x, run.y)
+    return run_figure(zero_time, np.zeros(1000))
+
+
+# Instruments are connected on first use: the layout is built from the
+# generator settings last set or read (or defaults) and the latest frame,
+# and the acquisition loop only starts once a page is served.
+def serve_layout():
+    acquisition_loop.start()
+    return layout()
+
+
+def layout():
+    return html.Div(id='container', children=[
+        # Function Generator Panel - Left
+        html.Div([
+            html.H2("Dash DAQ: Function Generator & Oscilloscope Control Panel",
+                    style={'marginLeft': '40px'}),
+            html.Img(src="https://s3-us-west-1.amazonaws.com/plotly-tutorials/" +
+                     "excel/dash-daq/dash-daq-logo-by-plotly-stripe+copy.png")
+        ], className='banner', id='header'),
+
+        html.Div([
+            html.Div([
+                html.Div([
+                    html.H3("POWER", id="power-title")
+                ], className='Title'),
+                html.Div([
+                    html.Div([
+                        daq.PowerButton(
+                            id='function-generator',
+                            on='true',
+                            label="Function Generator",
+                            labelPosition='bottom',
+                            color="#447EFF"),
+                    ], className='six columns', style={'margin-bottom': '15px'}),
+                    html.Div([
+                        daq.PowerButton(
+                            id='oscilloscope',
+                            on='true',
+                            label="Oscilloscope",
+                            labelPosition='bottom',
+                            color="#447EFF")
+                    ], className='six columns', style={'margin-bottom': '15px'}),
+                ], style={'margin': '15px 0'})
+            ], className='row power-settings-tab'),
+            html.Div([
+                html.Div(
+                    [html.H3("FUNCTION", id="function-title")],
+                    className='Title'),
+                html.Div([
+                    daq.Knob(
+                        value=fgen.cached('FREQUENCY'),
+                        id="frequency-input",
+                        label="Frequency (Hz)",
+                        labelPosition="bottom",
+                        size=75,
+                        color="#447EFF",
+                        scale={'interval': 1E5},
+                        max=2.5E6,
+                        min=1E5,
+                        className='four columns'
+                    ),
+                    daq.Knob(
+                        value=fgen.cached('VOLTAGE:AMPLITUDE'),
+                        id="amplitude-input",
+                        label="Amplitude (mV)",
+                        labelPosition="bottom",
+                        size=75,
+                        scale={'labelInterval': 10},
+                        color="#447EFF",
+                        max=10,
+                        className='four columns'
+                    ),
+                    daq.Knob(
+                        value=fgen.cached('VOLTAGE:OFFSET'),
+                        id="offset-input",
+                        label="Offset (mV)",
+                        labelPosition="bottom",
+                        size=75,
+                        scale={'labelInterval': 10},
+                        color="#447EFF",
+                        max=10,
+                        className='four columns'
+                    )], style={'marginLeft': '20%', 'textAlign': 'center'}),
+                html.Div([
+                    daq.LEDDisplay(
+                        id='frequency-display',
+                        size=10,
+                        label="Frequency (Hz)",
+                        labelPosition="bottom",
+                        color="#447EFF",
+                        style={'marginBottom': '30px'},
+                        className='four columns'),
+                    daq.LEDDisplay(
+                        id='amplitude-display',
+                        size=10,
+                        label="Amplitude (mV)",
+                        labelPosition="bottom",
+                        color="#447EFF",
+                        className='four columns'),
+                    daq.LEDDisplay(
+                        id='offset-display',
+                        size=10,
+                        label="Offset (mV)",
+                        labelPosition="bottom",
+                        color="#447EFF",
+                        className='four columns'),
+                ], style={'marginLeft': '20%', 'textAlign': 'center'}),
+                dcc.RadioItems(
+                    id='function_type',
+                    options=[
+                        {'label': 'Sine', 'value': 'SIN'},
+                        {'label': 'Square', 'value': 'SQUARE'},
+                        {'label': 'Ramp', 'value': 'RAMP'},
+                        {'label': 'Pulse', 'value': 'PULSE'},
+                    ],
+                    value=fgen.cached('FUNC'),
+                    labelStyle={'display': 'inline-block'},
+                    style={'margin': '30px auto 0px auto',
+                           'display': 'flex',
+                           'width': '80%',
+                           'alignItems': 'center',
+                           'justifyContent': 'space-between'}
+                    )
+                ], className='row power-settings-tab'),
+            html.Hr(),
+            daq.ColorPicker(
+                id="color-picker",
+                label="Color Picker",
+                value=dict(hex="#447EFF"),
+                size=164,
+                theme={'dark': True}
+            ),
+        ], className='four columns left-panel'),
+
+        # Oscillator Panel - Right
+        html.Div([
+            html.Div([html.H3("GRAPH", id="graph-title")], className='Title'),
+            dcc.Tabs(
+                children=tab_components(),
+                value=1,
+                id='tabs',
+                style={'backgroundColor': '#447EFF', 'height': '80%'},
+            ),
+
+            html.Div([
+                html.Div([
+                    html.Div([
+                        html.Div(
+                            id="graph_info",
+                            style={
+                                'textAlign': 'center',
+                                'fontSize': '16px',
+                                'padding': '0px 5px',
+                                'lineHeight': '20px',
+                                'border': '2px solid #447EFF'}),
+                     ], className="row graph-param"),
+                ], className="six columns"),
+                dcc.Checklist(
+                    id='channels',
+                    options=[
+                        {'label': 'CH1', 'value': 'CH1'},
+                        {'label': 'CH2', 'value': 'CH2'},
+                        {'label': 'MATH', 'value': 'MATH'},
+                    ],
+                    values=list(channels),
+                    labelStyle={'display': 'inline-block',
+                                'marginRight': '10px'},
+                    className='two columns'),
+                daq.ToggleSwitch(
+                    id='logging',
+                    value=capture is not None,
+                    label='Log to disk',
+                    labelPosition='bottom',
+                    className='two columns'),
+                html.Button('+',
+                            id='new_tab',
+                            type='submit',
+                            style={'height': '20px', 'width': '20px',
+                                   'padding': '2px', 'lineHeight': '10px',
+                                   'float': 'right'}),
+            ], className='row oscope-info', style={'margin': '15px'}),
+            html.Hr(),
+            dcc.RadioItems(
+                id='display',
+                options=[
+                    {'label': 'Time', 'value': 'time'},
+                    {'label': 'Average', 'value': 'average'},
+                    {'label': 'Envelope', 'value': 'envelope'},
+                    {'label': 'Persistence', 'value': 'persistence'},
+                    {'label': 'Spectrum', 'value': 'spectrum'},
+                ],
+                value=display,
+                labelStyle={'display': 'inline-block', 'marginRight': '10px'},
+                style={'marginLeft': '15px'}),
+            dcc.Graph(
+                id='oscope-graph',
+                figure=initial_figure(),
+                config={'displayModeBar': True,
+                        'modeBarButtonsToRemove': ['pan2d',
+                                                   'zoomIn2d',
+                                                   'zoomOut2d',
+                                                   'autoScale2d',
+                                                   'hoverClosestCartesian',
+                                                   'hoverCompareCartesian']}
+            ),
+            # replay of logged captures; the live scope is shown while no
+            # capture is selected
+            html.Div([
+                dcc.Dropdown(
+                    id='capture',
+                    options=capture_options(),
+                    placeholder='Live',
+                    className='four columns'),
+                html.Div([
+                    dcc.Slider(
+                        id='replay-time',
+                        min=0,
+                        max=0,
+                        step=0.1,
+                        value=0,
+                        updatemode='drag'),
+                ], className='eight columns'),
+            ], className='row replay', style={'margin': '15px'}),
+            dcc.Graph(
+                id='replay-overview',
+                style={'display': 'none'},
+                config={'displayModeBar': False}),
+        ], className='seven columns right-panel'),
+        # compact frames applied to oscope-graph on the client; new live
+        # frames are pushed through oscope/stream (assets/stream.js), which
+        # clicks oscope-push to have them applied
+        dcc.Store(id='oscope-frame'),
+        html.Button(id='oscope-push', style={'display': 'none'}),
+    ])
+
+
+app.layout = serve_layout
+
+
+# Callback for color picker, applied in the browser (assets/clientside.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='theme', function_name='color'),
+    [Output('frequency-input', 'color'),
+     Output('amplitude-input', 'color'),
+     Output('offset-input', 'color'),
+     Output('frequency-display', 'color'),
+     Output('amplitude-display', 'color'),
+     Output('offset-display', 'color'),
+     Output('function-generator', 'color'),
+     Output('oscilloscope', 'color'),
+     Output('graph_info', 'style'),
+     Output('tabs', 'style'),
+     Output('power-title', 'style'),
+     Output('function-title', 'style'),
+     Output('graph-title', 'style'),
+     Output('header', 'style')],
+    [Input('color-picker', 'value')])
+
+
+# Callback for knob inputs; only the setting that changed is sent
+@app.callback([Output('frequency-display', 'value'),
+               Output('amplitude-display', 'value'),
+               Output('offset-display', 'value')],
+              [Input('frequency-input', 'value'),
+               Input('amplitude-input', 'value'),
+               Input('offset-input', 'value'),
+               Input('function_type', 'value')])
+def update_fgen(frequency, amplitude, offset, wave):
+    changed = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'frequency-input.value' in changed:
+        fgen.set_frequency(frequency)
+    if 'amplitude-input.value' in changed:
+        fgen.set_amplitude(amplitude)
+    if 'offset-input.value' in changed:
+        fgen.set_offset(offset)
+    if 'function_type.value' in changed:
+        fgen.set_wave(wave)
+    return frequency, amplitude, offset
+
+
+# the scope is rescaled for a new generator setting once it has been sent,
+# so AUTOSET never runs on the previous signal
+fgen.listeners.append(lambda message: osc.autoset())
+
+
+def run_info(value):
+    run = runs.load(value)
+    if run is not None:
+        return run.info
+    return "-"
+
+
+# Frames for changes made on the page, with the graph info of the tab; live
+# frames stop being applied while a capture is replayed
+@app.callback(Output('oscope-frame', 'data'),
+              [Input('tabs', 'value'),
+               Input('oscope-graph', 'relayoutData'),
+               Input('channels', 'values'),
+               Input('capture', 'value'),
+               Input('replay-time', 'value'),
+               Input('display', 'value')])
+def update_output(value, relayout, selected, replay, seconds, mode):
+    return dict(output_frame(value, relayout, selected, replay, seconds, mode),
+                info=run_info(value))
+
+
+def output_frame(value, relayout, selected, replay, seconds, mode):
+    global tab, channels, display, stale_relayout
+
+    if selected and tuple(selected) != channels:
+        channels = tuple(selected)
+        reset_accumulators()
+
+    if mode and mode != display:
+        display = mode
+        reset_accumulators()
+        stale_relayout = relayout
+    if relayout == stale_relayout:
+        relayout = None
+
+    if replay:
+        return dict(replay_frame(replay, seconds, relayout), live=False)
 
     if tab is not value:
-        if '' + str(value) in runs:
-            tab = value
-            return runs['' + str(value)][0]
+        run = runs.load(value)
         tab = value
-        return zero
+        if run is not None and run.y is not None:
+            return display_frame(run.x, run.y, relayout, run.settings.get('channels'))
+        return zero_frame
 
     else:
-        figure = {
-            'data': osc.get_data(),
-            'layout': go.Layout(
-                xaxis={'title': 's', 'color': '#506784',
-                       'titlefont': dict(
-                           family='Dosis',
-                           size=15,
-                       )},
-                yaxis={'title': 'Voltage (mV)', 'color': '#506784',
-                       'titlefont': dict(
-                           family='Dosis',
-                           size=15,
-                       ), 'autorange': False, 'range': [-10, 10]},
-                margin={'l': 40, 'b': 40, 't': 0, 'r': 50},
-                plot_bgcolor='#F3F6FA',)
-        }
-
-        runs['' + str(value)] = figure, str(fgen.get_wave()) + " | " + \
-            str(fgen.get_frequency()) + "Hz" + " | " + \
-            str(fgen.get_amplitude()) + "mV" + " | " +  \
-            str(fgen.get_offset()) + "mV"
-
-        # wait to update the runs variable
-        sleep(0.10)
-
-        return figure
-
-
-@app.callback(Output('tabs', 'tabs'),
+        frame = acquisition_loop.latest()
+        if frame is None:
+            return zero_frame
+        return live_frame(frame, relayout, frame_names(frame))
+
+
+# Server-Sent Events: each new acquisition is pushed to every open page as
+# one 'data:' event holding a frame in the selected display, decimated to
+# the x0..x1 window the page asks for. Pages without new frames cost nothing,
+# and pages showing the same window share one serialized event per frame.
+# Each open stream holds a server thread, so gunicorn has to run app:server
+# with threaded (--threads) or gevent workers; see the README for how many.
+KEEPALIVE = 15      # seconds between comments sent on an idle stream
+
+# events by (frame seq, display, window); the lock lets the streams woken by
+# a frame wait for the first one to build it instead of each building it
+stream_events = LRUCache(16)
+stream_lock = threading.Lock()
+
+
+def stream_event(frame, window):
+    def build():
+        relayout = None if window is None else {'xaxis.range': list(window)}
+        payload = live_frame(frame, relayout, frame_names(frame))
+        payload['info'] = live_info
+        return 'data: {}\n\n'.format(json.dumps(payload))
+    with stream_lock:
+        return stream_events.get_or_compute((frame.seq, display, window), build)
+
+
+@server.route(app.config.routes_pathname_prefix + 'oscope/stream')
+def oscope_stream():
+    window = None
+    if 'x0' in flask.request.args and 'x1' in flask.request.args:
+        window = (float(flask.request.args['x0']), float(flask.request.args['x1']))
+
+    def events():
+        seq = 0
+        while True:
+            frame = acquisition_loop.wait(seq, timeout=KEEPALIVE)
+            if frame is None:
+                yield ': keepalive\n\n'
+                continue
+            seq = frame.seq
+            yield stream_event(frame, window)
+
+    return flask.Response(events(), mimetype='text/event-stream',
+                          headers={'Cache-Control': 'no-cache',
+                                   'X-Accel-Buffering': 'no'})
+
+
+# Logging writes every acquired frame of this worker to a new capture under
+# CAPTURE_PATH until it is switched off
+@app.callback([Output('logging', 'label'),
+               Output('capture', 'options')],
+              [Input('logging', 'value')])
+def update_logging(on):
+    global capture
+    if on and capture is None:
+        capture = capture_log.CaptureLog(capture_log.new_path())
+    elif not on and capture is not None:
+        log, capture = capture, None
+        log.close()
+    if capture is not None:
+        return 'Logging to ' + capture.path, capture_options()
+    return 'Log to disk', capture_options()
+
+
+# Replay slider range and capture overview, read again when logging stops
+# so the capture that was being written is complete
+@app.callback([Output('replay-time', 'max'),
+               Output('replay-time', 'marks'),
+               Output('replay-overview', 'figure'),
+               Output('replay-overview', 'style')],
+              [Input('capture', 'value'),
+               Input('logging', 'value')])
+def update_replay(name, _):
+    if not name:
+        changed = [t['prop_id'] for t in dash.callback_context.triggered]
+        if 'capture.value' not in changed:
+            raise PreventUpdate
+        return 0, {}, {'data': []}, {'display': 'none'}
+    log = replay_log(name)
+    if not len(log):
+        raise PreventUpdate
+    times = log.timestamps()
+    duration = float(times[-1] - times[0])
+    marks = {int(seconds): '{:g} s'.format(int(seconds))
+             for seconds in np.linspace(0, duration, 5)}
+    return duration, marks, overview_figure(log), {'display': 'block'}
+
+
+# Callbacks graph and graph info, applied in the browser from the frames of
+# update_output and of the live stream
+app.clientside_callback(
+    ClientsideFunction(namespace='oscope', function_name='update_graph'),
+    [Output('oscope-graph', 'figure'),
+     Output('graph_info', 'children')],
+    [Input('oscope-frame', 'data'),
+     Input('oscope-push', 'n_clicks')],
+    [State('oscope-graph', 'figure'),
+     State('graph_info', 'children')])
+
+
+@app.callback(Output('tabs', 'children'),
               [Input('new_tab', 'n_clicks')])
 def new_tabs(n_clicks):
     if n_clicks is not None:
         tabs.append({'label': 'Run #' + str(tabs[-1]['value'] + 1),
                      'value': int(tabs[-1]['value']) + 1})
-        return tabs
-    return tabs
+        return tab_components()
+    return tab_components()
 
 
 external_css = ["https://codepen.io/chriddyp/pen/bWLwgP.css",
@@ -6,8 +6,15 @@ import dash_html_components as html
 import dash_core_components as dcc
 from dash.exceptions import PreventUpdate
 
+import flask
 import numpy as np
-from scipy import signal
+
+import decimate
+import measure
+import offload
+import run_store
+import waveform
+from cache import LRUCache
 
 app = dash.Dash(__name__)
 app.config['suppress_callback_exceptions'] = True
@@ -18,6 +25,21 @@ background_color = {'dark': '#2a3f5f', 'light': '#ffffff'}
 axis_color = {'dark': '#EBF0F8', 'light': '#506784'}
 marker_color = {'dark': '#f2f5fa', 'light': '#2a3f5f'}
 
+# number of points synthesized per trace; traces are decimated to the graph
+# width before they are sent, and zooming in re-reads the full resolution
+sample_count = 100000
+
+# synthesized traces with their min/max pyramids and measurements, and
+# finished (figure, info) payloads, keyed on the generator settings so theme
+# toggles and tab switches skip synthesis and zooming out skips the
+# full-resolution scan
+waveform_cache = LRUCache(maxsize=32)
+figure_cache = LRUCache(maxsize=64)
+
+# per-tab generator settings by run ID; the browser only holds the run IDs.
+# Every browser tab adds runs, kept apart from app.py's and expired by age.
+runs = run_store.RunStore(default='runs-mock.sqlite3')
+
 theme = {
     'dark': False,
     'primary': '#447EFF',
@@ -144,6 +166,7 @@ def radioitem(cur_input, cur_tab):
             {'label': 'Sine', 'value': 'SIN'},
             {'label': 'Square', 'value': 'SQUARE'},
             {'label': 'Ramp', 'value': 'RAMP'},
+            {'label': 'Pulse', 'value': 'PULSE'},
         ],
         value=cur_input[cur_tab]['function_type'],
         labelStyle={'display': 'inline-block'},
@@ -322,7 +345,7 @@ app.layout = html.Div(
                 ]
             )
         ),
-        dcc.Store(id='control-inputs', data={}  # {tabs_number: {value1:x, value2:x}
+        dcc.Store(id='control-inputs', data={}  # {tabs_number: run_id}
                   )
     ]
 )
@@ -347,10 +370,10 @@ app.layout = html.Div(
     ]
 )
 def update_controls(tab_index: str, cur_inputs, osci_on, func_gen):
-    if tab_index not in cur_inputs:
+    td = tab_settings(cur_inputs, tab_index)
+    if td is None:
         return osci_on, func_gen, 1000000, 1, 0, 'SIN'
 
-    td = cur_inputs[tab_index]
     return td['oscilloscope'], td['function_generator'], td['frequency_input'], td['amplitude_input'], \
            td['offset_input'], td['function_type']
 
@@ -369,26 +392,36 @@ def update_controls(tab_index: str, cur_inputs, osci_on, func_gen):
     [State('tabs', 'value'), State('control-inputs', 'data')]
 )
 def update_control_values(osc_on, fnct_on, frequency, amplitude, offset, wave, sel_tab, cur_inputs):
-    cur_inputs.update(
-        {sel_tab: dict(oscilloscope=osc_on, function_generator=fnct_on, frequency_input=frequency,
-                       amplitude_input=amplitude, offset_input=offset, function_type=wave)})
+    run_id = cur_inputs.get(sel_tab) or run_store.new_id()
+    runs.save(run_id, settings=dict(oscilloscope=osc_on, function_generator=fnct_on,
+                                    frequency_input=frequency, amplitude_input=amplitude,
+                                    offset_input=offset, function_type=wave))
+    cur_inputs.update({sel_tab: run_id})
     return cur_inputs
 
 
+def tab_settings(cur_inputs, tab_index):
+    if not cur_inputs or tab_index not in cur_inputs:
+        return None
+    return runs.settings(cur_inputs[tab_index])
+
+
 # new tab created not saved to store unless control inputs changes
 @app.callback(
     [Output('oscope-graph', 'figure'), Output('graph-info', 'children')],
-    [Input('control-inputs', 'data'), Input('toggleTheme', 'value')],
+    [Input('control-inputs', 'data'), Input('toggleTheme', 'value'),
+     Input('oscope-graph', 'relayoutData')],
     [State('tabs', 'value')]
 )
-def generate_graph(cur_inputs, theme_value, tab_index: str):
+def generate_graph(cur_inputs, theme_value, relayout, tab_index: str):
     theme_select = 'dark' if theme_value else 'light'
     axis = axis_color[theme_select]
     marker = marker_color[theme_select]
-    time = np.linspace(-0.000045, 0.000045, 1000)
+    x_range = decimate.x_range(relayout)
+    time = waveform.time_axis(1000)
 
     base_figure = dict(
-        data=[dict(x=time, y=[0] * len(time), marker={'color': marker})],
+        data=[dict(x=time, y=np.zeros(len(time)), marker={'color': marker})],
         layout=dict(xaxis=dict(title='s',
                                color=axis,
                                titlefont=dict(family='Dosis', size=13)),
@@ -398,13 +431,13 @@ def generate_graph(cur_inputs, theme_value, tab_index: str):
                                titlefont=dict(family='Dosis', size=13)),
                     margin={'l': 40, 'b': 40, 't': 20, 'r': 50},
                     plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)')
+                    paper_bgcolor='rgba(0,0,0,0)',
+                    uirevision='oscope')
     )
-    if tab_index not in cur_inputs:
+    tab_data = tab_settings(cur_inputs, tab_index)
+    if tab_data is None:
         return base_figure, '-'
 
-    tab_data = cur_inputs[tab_index]
-
     if not tab_data['oscilloscope']:
         base_figure.update(data=[])
         base_figure['layout']['xaxis'].update(showticklabels=False, showline=False, zeroline=False)
@@ -414,33 +447,46 @@ def generate_graph(cur_inputs, theme_value, tab_index: str):
     if not tab_data['function_generator']:
         return base_figure, '-'
 
-    if tab_data['function_type'] == 'SIN':
-        y = [float(tab_data['offset_input']) +
-             (float(tab_data['amplitude_input']) *
-              np.sin(np.radians(2.0 * np.pi * float(tab_data['frequency_input']) * t)))
-             for t in time]
-
-    elif tab_data['function_type'] == 'SQUARE':
-        y = [float(tab_data['offset_input']) +
-             float(tab_data['amplitude_input']) *
-             (signal.square(2.0 * np.pi * float(tab_data['frequency_input']) / 10 * t))
-             for t in time]
-
-    elif tab_data['function_type'] == 'RAMP':
-        y = float(tab_data['amplitude_input']) * \
-            (np.abs(signal.sawtooth(2 * np.pi * float(tab_data['frequency_input']) / 10 * time)))
-        y = float(tab_data['offset_input']) + 2 * y - float(tab_data['amplitude_input'])
-    else:
+    if tab_data['function_type'] not in waveform.FUNCTION_TYPES:
         return base_figure, '-'
 
-    base_figure['data'][0].update(y=y)
+    key = waveform_key(tab_data)
+    cached = figure_cache.get((key, theme_select, x_range))
+    if cached is not None:
+        return cached
+
+    y, levels, measurements = waveform_cache.get_or_compute(key, lambda: load_waveform(key))
+    x, y = decimate.decimate(waveform.time_axis(sample_count), y, x_range, levels=levels)
+
+    base_figure['data'][0].update(x=x, y=y)
 
     info = (f'{tab_data["function_type"]}|{tab_data["frequency_input"]}Hz|'
-            f'{tab_data["amplitude_input"]} mV | {tab_data["offset_input"]} mV')
+            f'{tab_data["amplitude_input"]} mV | {tab_data["offset_input"]} mV || '
+            f'{measure.describe(measurements, unit="mV")}')
 
+    figure_cache.put((key, theme_select, x_range), (base_figure, info))
     return base_figure, info
 
 
+def waveform_key(tab_data):
+    return (tab_data['function_type'], float(tab_data['frequency_input']),
+            float(tab_data['amplitude_input']), float(tab_data['offset_input']),
+            sample_count)
+
+
+def load_waveform(key):
+    # synthesis and analysis run in the offload pool when there is one
+    y, levels, measurements = offload.run(waveform.analyzed, *key)
+    # shared through the cache, so never modified in place
+    y.flags.writeable = False
+    return y, levels, measurements
+
+
+@server.route('/cache-stats')
+def cache_stats():
+    return flask.jsonify(waveform=waveform_cache.stats(), figure=figure_cache.stats())
+
+
 # Callback to update theme layout
 @app.callback(
     Output("dark-theme-components", 'children'),
@@ -453,6 +499,9 @@ def turn_dark(turn_dark, color_pick, cur_inputs, cur_tab_value):
     if color_pick is not None:
         theme.update(primary=color_pick['hex'])
 
+    settings = tab_settings(cur_inputs, cur_tab_value)
+    cur_inputs = None if settings is None else {cur_tab_value: settings}
+
     return DarkThemeProvider(
         theme=theme,
         children=[
@@ -0,0 +1,118 @@
+// Clientside callbacks for the oscilloscope graph and the color theme.
+(function() {
+    var axisCache = {key: null, values: null};
+    // live is false while the graph shows a replayed capture; pushed is the
+    // latest frame of assets/stream.js, applied when it clicks oscope-push
+    var state = {live: true, pushed: null, pushes: null};
+
+    function decode(encoded) {
+        if (encoded.step !== undefined) {
+            var key = encoded.start + ':' + encoded.step + ':' + encoded.length;
+            if (axisCache.key !== key) {
+                var values = new Float64Array(encoded.length);
+                for (var i = 0; i < encoded.length; i++) {
+                    values[i] = encoded.start + i * encoded.step;
+                }
+                axisCache = {key: key, values: values};
+            }
+            return axisCache.values;
+        }
+        var text = atob(encoded.data);
+        var bytes = new Uint8Array(text.length);
+        for (var j = 0; j < text.length; j++) {
+            bytes[j] = text.charCodeAt(j);
+        }
+        return new Float32Array(bytes.buffer);
+    }
+
+    function rows(encoded) {
+        // split a (channels, samples) array into one typed array per trace
+        var values = decode(encoded);
+        if (encoded.shape.length < 2) {
+            return [values];
+        }
+        var length = encoded.shape[1];
+        var result = [];
+        for (var row = 0; row < encoded.shape[0]; row++) {
+            result.push(values.subarray(row * length, (row + 1) * length));
+        }
+        return result;
+    }
+
+    function applyFrame(frame, figure) {
+        figure = figure || {data: [], layout: {}};
+        if (!frame) {
+            return figure;
+        }
+        state.live = frame.live !== false;
+        var xs = frame.x.step !== undefined ? [decode(frame.x)] : rows(frame.x);
+        var templates = figure.data.filter(function(trace) {
+            return trace.type !== 'heatmap';
+        });
+        var data = frame.bins ? [{
+            // persistence map: y holds the hits of each voltage bin
+            type: 'heatmap',
+            x: xs[0],
+            y: decode(frame.bins),
+            z: rows(frame.y),
+            colorscale: 'Hot',
+            reversescale: true,
+            showscale: false
+        }] : rows(frame.y).map(function(y, index) {
+            var trace = Object.assign({}, templates[index] || templates[0] || {});
+            trace.x = xs[index] || xs[0];
+            trace.y = y;
+            if (frame.names) {
+                trace.name = frame.names[index];
+            }
+            return trace;
+        });
+        var layout = Object.assign({}, figure.layout);
+        Object.keys(frame.layout || {}).forEach(function(key) {
+            // axis settings of the display the frame belongs to
+            var value = frame.layout[key];
+            layout[key] = typeof value === 'object' ?
+                Object.assign({}, layout[key], value) : value;
+        });
+        return {data: data, layout: layout};
+    }
+
+    function updateGraph(frame, pushes, figure, info) {
+        // oscope-graph figure and graph_info text for a frame of the
+        // oscope-frame store, or for the pushed frame when oscope-push fired
+        if (pushes !== state.pushes) {
+            state.pushes = pushes;
+            frame = state.live ? state.pushed : null;
+        }
+        if (!frame) {
+            return [figure, info];
+        }
+        return [applyFrame(frame, figure), frame.info !== undefined ? frame.info : info];
+    }
+
+    function themeColor(color) {
+        // outputs in the order registered by the color-picker callback
+        var hex = color.hex;
+        return [
+            hex, hex, hex,                  // knobs
+            hex, hex, hex,                  // LED displays
+            hex, hex,                       // power buttons
+            {textAlign: 'center', border: '2px solid ' + hex},
+            {backgroundColor: hex},         // tabs
+            {color: hex}, {color: hex}, {color: hex},
+            {backgroundColor: hex}          // header
+        ];
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        oscope: {
+            decode: decode,
+            apply_frame: applyFrame,
+            update_graph: updateGraph,
+            state: state
+        },
+        theme: {
+            color: themeColor
+        }
+    });
+})();
@@ -0,0 +1,74 @@
+// Live oscope-graph updates pushed by the server as Server-Sent Events.
+//
+// Each event is a frame like the ones of the oscope-frame store. It is left
+// for oscope.update_graph (assets/clientside.js) and the hidden oscope-push
+// button is clicked, so Dash applies it to the figure and graph info it
+// keeps for the page; the zoom survives through uirevision. When the x axis
+// is zoomed the stream is reopened for the visible window, so frames arrive
+// decimated for it.
+(function() {
+    var source = null;
+    var range = null;
+    var uirevision = null;
+    var graph = null;
+    var push = null;
+
+    function streamUrl() {
+        var config = JSON.parse(document.getElementById('_dash-config').textContent);
+        var url = config.requests_pathname_prefix + 'oscope/stream';
+        return range ? url + '?x0=' + range[0] + '&x1=' + range[1] : url;
+    }
+
+    function connect() {
+        if (source) {
+            source.close();
+        }
+        source = new EventSource(streamUrl());
+        source.onmessage = function(event) {
+            var oscope = window.dash_clientside.oscope;
+            if (!oscope.state.live) {
+                return;
+            }
+            var frame = JSON.parse(event.data);
+            oscope.state.pushed = frame;
+            push.click();
+            if (frame.layout && frame.layout.uirevision !== uirevision) {
+                // display changed; its axes start autoscaled
+                uirevision = frame.layout.uirevision;
+                if (range) {
+                    range = null;
+                    connect();
+                }
+            }
+        };
+    }
+
+    function onRelayout(event) {
+        if (event['xaxis.autorange']) {
+            range = null;
+        } else if (event['xaxis.range[0]'] !== undefined) {
+            range = [event['xaxis.range[0]'], event['xaxis.range[1]']];
+        } else if (event['xaxis.range']) {
+            range = event['xaxis.range'];
+        } else {
+            return;
+        }
+        connect();
+    }
+
+    function start() {
+        // the graph is rendered by Dash after this script has run
+        graph = document.querySelector('#oscope-graph .js-plotly-plot');
+        push = document.getElementById('oscope-push');
+        if (!graph || !graph.on || !push) {
+            setTimeout(start, 200);
+            return;
+        }
+        graph.on('plotly_relayout', onRelayout);
+        connect();
+    }
+
+    if (window.EventSource) {
+        start();
+    }
+})();
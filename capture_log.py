@@ -0,0 +1,259 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from pyramid import Pyramid
+
+# Append-only on-disk log of raw oscilloscope frames.
+#
+# A capture is a directory with three files:
+#   frames.bin    int16 curve codes as sent by the scope, frame after frame
+#   index.bin     one INDEX record per frame: timestamp, position and shape
+#                 of the frame in frames.bin, and the preamble to scale it
+#   overview.bin  min and max code of each channel of each frame, read to
+#                 draw a whole capture without touching frames.bin
+# Both files are only ever appended to, so hours of capture stay on disk and
+# are read back through np.memmap: a frame is a view on the mapped file and
+# only the pages that are sliced are read. A frame is written before its
+# index record, and readers only trust complete index records, so a capture
+# cut short by a crash stays readable.
+
+MAX_CHANNELS = 4
+
+INDEX = np.dtype([
+    ('timestamp', '<f8'),
+    ('offset', '<i8'),          # in samples from the start of frames.bin
+    ('channels', '<i4'),
+    ('points', '<i4'),
+    ('xincr', '<f8'),
+    ('sources', 'S4', (MAX_CHANNELS,)),
+    ('ymult', '<f8', (MAX_CHANNELS,)),
+    ('yzero', '<f8', (MAX_CHANNELS,)),
+    ('yoff', '<f8', (MAX_CHANNELS,)),
+])
+
+OVERVIEW = np.dtype(('<i2', (MAX_CHANNELS, 2)))
+
+
+def root():
+    return os.environ.get('CAPTURE_PATH', 'captures')
+
+
+def new_path():
+    # captures/<start time>, unique within a process
+    path = os.path.join(root(), time.strftime('%Y%m%d-%H%M%S'))
+    suffix = 1
+    candidate = path
+    while os.path.exists(candidate):
+        suffix += 1
+        candidate = '{}-{}'.format(path, suffix)
+    return candidate
+
+
+def capture_path(name):
+    return os.path.join(root(), name)
+
+
+def list_captures():
+    if not os.path.isdir(root()):
+        return []
+    return sorted(name for name in os.listdir(root())
+                  if os.path.isfile(os.path.join(root(), name, 'index.bin')))
+
+
+def write(handle, data):
+    # all of data to an unbuffered file, which may take part of it per call
+    view = memoryview(data).cast('B')
+    while view:
+        view = view[handle.write(view):]
+
+
+class CaptureLog:
+    def __init__(self, path):
+        self.path = path
+        self.frames_path = os.path.join(path, 'frames.bin')
+        self.index_path = os.path.join(path, 'index.bin')
+        self.overview_path = os.path.join(path, 'overview.bin')
+        self.lock = threading.Lock()
+        self.frames_file = None
+        self.index_file = None
+        self.overview_file = None
+        self.closed = False
+        self.end = None         # samples in frames.bin covered by the index
+        self.count = 0          # index records written by append()
+        self.index = np.zeros(0, dtype=INDEX)
+        self.frames = np.zeros(0, dtype='<i2')
+        # in memory copies grown by refresh(), for searchsorted and overview()
+        self.times = np.zeros(0)
+        self.summary = np.zeros(0, dtype=OVERVIEW)
+        self.envelope = np.zeros((0, MAX_CHANNELS, 2), dtype=np.float32)
+        # [channel][min, max] pyramids of the envelope, extended by refresh()
+        self.levels = [(Pyramid(), Pyramid()) for _ in range(MAX_CHANNELS)]
+
+    # writing
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.refresh()
+        # drop a frame or index record left half written by a crash
+        with open(self.index_path, 'ab') as index_file:
+            index_file.truncate(len(self.index) * INDEX.itemsize)
+        with open(self.frames_path, 'ab') as frames_file:
+            frames_file.truncate(self.end * 2)
+        with open(self.overview_path, 'ab') as overview_file:
+            overview_file.truncate(min(os.path.getsize(self.overview_path),
+                                       len(self.index) * OVERVIEW.itemsize))
+        # unbuffered, so a failed write leaves nothing behind to be flushed
+        # later and truncate() can undo it
+        self.frames_file = open(self.frames_path, 'ab', buffering=0)
+        self.index_file = open(self.index_path, 'ab', buffering=0)
+        self.overview_file = open(self.overview_path, 'ab', buffering=0)
+        self.count = len(self.index)
+        # captures written before overview.bin existed get theirs filled in
+        missing = self.count - os.path.getsize(self.overview_path) // OVERVIEW.itemsize
+        if missing > 0:
+            write(self.overview_file, self.summary[-missing:].tobytes())
+
+    def truncate(self):
+        # drop whatever part of a frame was written after the last index record
+        self.frames_file.truncate(self.end * 2)
+        self.overview_file.truncate(self.count * OVERVIEW.itemsize)
+        self.index_file.truncate(self.count * INDEX.itemsize)
+
+    def append(self, sources, blocks, preambles, timestamp=None):
+        # Log one frame: blocks are the int16 codes of each source (views
+        # on the instrument response are fine, they are written directly)
+        # and preambles the osc_tds350.Preamble of each source.
+        if len(sources) > MAX_CHANNELS:
+            raise ValueError("at most {} channels per frame".format(MAX_CHANNELS))
+        with self.lock:
+            if self.closed:
+                return
+            if self.frames_file is None:
+                self.open()
+            record = np.zeros(1, dtype=INDEX)
+            record['timestamp'] = time.time() if timestamp is None else timestamp
+            record['offset'] = self.end
+            record['channels'] = len(sources)
+            record['points'] = len(blocks[0])
+            record['xincr'] = preambles[sources[0]].xincr
+            for column, source in enumerate(sources):
+                pre = preambles[source]
+                record['sources'][0, column] = source.encode()
+                record['ymult'][0, column] = pre.ymult
+                record['yzero'][0, column] = pre.yzero
+                record['yoff'][0, column] = pre.yoff
+
+            summary = np.zeros(1, dtype=OVERVIEW)
+            try:
+                for column, codes in enumerate(blocks):
+                    summary[0, column] = codes.min(), codes.max()
+                    write(self.frames_file, np.ascontiguousarray(codes, dtype='<i2').data)
+                write(self.overview_file, summary.tobytes())
+                write(self.index_file, record.tobytes())
+            except OSError:
+                # e.g. disk full: the next frame goes where this one started
+                self.truncate()
+                raise
+            self.end += len(sources) * len(blocks[0])
+            self.count += 1
+
+    def close(self):
+        # stop logging; frames passed to append() afterwards are dropped
+        with self.lock:
+            self.closed = True
+            for handle in (self.frames_file, self.index_file, self.overview_file):
+                if handle is not None:
+                    handle.close()
+            self.frames_file = self.index_file = self.overview_file = None
+
+    # reading
+
+    def refresh(self):
+        # map frames appended since the last call; returns the frame count
+        index_size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        count = index_size // INDEX.itemsize
+        if count != len(self.index):
+            self.index = np.memmap(self.index_path, dtype=INDEX, mode='r',
+                                   shape=(count,)) if count else np.zeros(0, dtype=INDEX)
+        known = len(self.times)
+        if count > known:
+            self.times = np.concatenate([self.times, self.index['timestamp'][known:]])
+        if count:
+            last = self.index[-1]
+            self.end = int(last['offset'] + last['channels'] * last['points'])
+        else:
+            self.end = 0
+        if self.end > len(self.frames):
+            self.frames = np.memmap(self.frames_path, dtype='<i2', mode='r',
+                                    shape=(self.end,))
+        if count > known:
+            summary = self.read_summary(known, count)
+            self.summary = np.concatenate([self.summary, summary])
+            index = self.index[known:count]
+            volts = (summary - index['yoff'][:, :, np.newaxis]) \
+                * index['ymult'][:, :, np.newaxis] + index['yzero'][:, :, np.newaxis]
+            self.envelope = np.concatenate([self.envelope, volts.astype(np.float32)])
+            for column, pair in enumerate(self.levels):
+                for side, levels in enumerate(pair):
+                    levels.extend(self.envelope[:, column, side])
+        return count
+
+    def read_summary(self, start, stop):
+        size = os.path.getsize(self.overview_path) if os.path.exists(self.overview_path) else 0
+        stored = min(size // OVERVIEW.itemsize, stop)
+        summary = np.zeros(stop - start, dtype=OVERVIEW)
+        if stored > start:
+            with open(self.overview_path, 'rb') as overview_file:
+                overview_file.seek(start * OVERVIEW.itemsize)
+                summary[:stored - start] = np.fromfile(overview_file, dtype=OVERVIEW,
+                                                       count=stored - start)
+        for position in range(max(stored, start), stop):
+            codes = self.codes(position)
+            summary[position - start, :len(codes)] = np.stack(
+                [codes.min(axis=1), codes.max(axis=1)], axis=1)
+        return summary
+
+    def __len__(self):
+        return len(self.index)
+
+    def timestamps(self):
+        return self.times
+
+    def seek(self, timestamp):
+        # position of the last frame taken at or before timestamp (the first
+        # frame before the capture starts), a binary search on the index
+        position = int(np.searchsorted(self.times, timestamp, side='right')) - 1
+        return min(max(position, 0), len(self.times) - 1)
+
+    def overview(self):
+        # (timestamps, low, high) of the whole capture in volts, low and high
+        # as (frames, channels) envelopes of every frame; self.levels holds
+        # their pyramids
+        return self.times, self.envelope[..., 0], self.envelope[..., 1]
+
+    def codes(self, position):
+        # raw (channels, points) codes of a frame, a view on the mapped file
+        record = self.index[position]
+        channels, points = int(record['channels']), int(record['points'])
+        start = int(record['offset'])
+        return self.frames[start:start + channels * points].reshape(channels, points)
+
+    def sources(self, position):
+        record = self.index[position]
+        return [source.decode() for source in record['sources'][:record['channels']]]
+
+    def frame(self, position, out=None):
+        # (timestamp, x, y) of a frame scaled to volts, y as (channels, points)
+        record = self.index[position]
+        codes = self.codes(position)
+        if out is None or out.shape != codes.shape:
+            out = np.empty(codes.shape, dtype=np.float32)
+        for column, row in enumerate(out):
+            np.subtract(codes[column], record['yoff'][column], out=row, casting='unsafe')
+            row *= record['ymult'][column]
+            row += record['yzero'][column]
+        x = np.arange(codes.shape[1]) * record['xincr']
+        return float(record['timestamp']), x, out
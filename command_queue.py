@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Coalescing write queue for instrument settings.
+#
+# Settings are queued under a key (the SCPI header they set); a newer value
+# for the same key replaces the pending one, so dragging a knob only sends
+# the position it stops at. A worker thread waits briefly for more changes,
+# then sends everything pending as one ';:'-joined message.
+
+
+class CommandQueue:
+    def __init__(self, send, delay=0.05, on_error=None, on_sent=None):
+        # send(message) writes one SCPI message to the instrument;
+        # on_sent(message) is called once it has been written
+        self.send = send
+        self.on_error = on_error
+        self.on_sent = on_sent
+        self.delay = delay
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.error = None
+        self.thread = None
+
+    def put(self, key, command):
+        # command is a string, or a callable returning one (or None to skip)
+        # that is evaluated on the worker thread just before sending
+        with self.condition:
+            self.pending.pop(key, None)
+            self.pending[key] = command
+            self.idle.clear()
+            self.condition.notify()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='command-queue',
+                                               daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            time.sleep(self.delay)
+            with self.condition:
+                keys = list(self.pending)
+                batch = list(self.pending.values())
+                self.pending.clear()
+            try:
+                commands = [command() if callable(command) else command
+                            for command in batch]
+                message = ';:'.join(command for command in commands if command)
+                if message:
+                    self.send(message)
+                    if self.on_sent is not None:
+                        self.on_sent(message)
+                self.error = None
+            except Exception as error:
+                print("ERROR: unable to send {}: {}".format(', '.join(keys), error))
+                self.error = error
+                if self.on_error is not None:
+                    self.on_error(error)
+            with self.condition:
+                if not self.pending:
+                    self.idle.set()
+
+    def flush(self, timeout=None):
+        # wait until everything queued so far has been sent
+        return self.idle.wait(timeout)
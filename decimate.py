@@ -0,0 +1,77 @@
+import numpy as np
+
+# Peak preserving min/max decimation of traces sent to dcc.Graph.
+#
+# A trace is cut to the visible x window and reduced to one (min, max) pair
+# per horizontal pixel, in the order the two samples occur, so the payload
+# size depends on the graph width and not on the record length.
+
+DEFAULT_WIDTH = 1000    # pixels
+
+
+def x_range(relayout):
+    # visible x window from dcc.Graph relayoutData, None when autoscaled
+    if not relayout or relayout.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout:
+        return relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    if 'xaxis.range' in relayout:
+        return tuple(relayout['xaxis.range'])
+    return None
+
+
+def window(x, x_range):
+    # slice of the samples inside x_range, including one sample either side
+    if x_range is None:
+        return slice(0, len(x))
+    low, high = sorted(float(v) for v in x_range)
+    start = max(int(np.searchsorted(x, low, side='left')) - 1, 0)
+    stop = min(int(np.searchsorted(x, high, side='right')) + 1, len(x))
+    return slice(start, stop)
+
+
+def minmax_indices(y, buckets):
+    # indices of the min and max sample of each bucket, in sample order
+    n = len(y)
+    size = -(-n // buckets)
+    whole = n // size * size
+    blocks = y[:whole].reshape(-1, size)
+    starts = np.arange(0, whole, size)
+    low = blocks.argmin(axis=1) + starts
+    high = blocks.argmax(axis=1) + starts
+    if whole < n:
+        tail = y[whole:]
+        low = np.append(low, whole + tail.argmin())
+        high = np.append(high, whole + tail.argmax())
+    indices = np.empty(2 * len(low), dtype=np.intp)
+    np.minimum(low, high, out=indices[0::2])
+    np.maximum(low, high, out=indices[1::2])
+    return indices
+
+
+def kept_indices(y, visible, width, levels=None):
+    # indices of the min/max samples of y[visible]; a pyramid.Pyramid of y
+    # narrows the samples scanned to a few per bucket
+    if levels is None:
+        return minmax_indices(y[visible], width) + visible.start
+    candidates = levels.indices(visible.start, visible.stop, width)
+    if len(candidates) <= 2 * width:
+        return candidates
+    return candidates[minmax_indices(y[candidates], width)]
+
+
+def decimate(x, y, x_range=None, width=DEFAULT_WIDTH, levels=None):
+    # y is one trace or a (channels, samples) stack; a decimated stack gets
+    # one x row per channel since the kept samples differ between channels.
+    # levels is pyramid.build(y), used instead of scanning every sample.
+    visible = window(x, x_range)
+    if visible.stop - visible.start <= 2 * width:
+        return x[visible], y[..., visible]
+    if y.ndim == 1:
+        indices = kept_indices(y, visible, width, levels)
+        return x[indices], y[indices]
+    if levels is None:
+        levels = [None] * len(y)
+    indices = np.array([kept_indices(row, visible, width, row_levels)
+                        for row, row_levels in zip(y, levels)])
+    return x[indices], np.take_along_axis(y, indices, axis=1)
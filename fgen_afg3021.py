@@ -1,22 +1,30 @@
+import threading
+
 import visa
 
+import visa_sessions
+from command_queue import CommandQueue
+
 # Adapted from code seen here:
 # https://github.com/baroobob/TektronixAFG3021B/blob/master/TektronixAFG3021B.py
 
-rm = visa.ResourceManager()
-fgenerator = None
+port = 'USB::0x0699::0x0340::C012268::INSTR'
 
-def open_port(port = 'USB::0x0699::0x0340::C012268::INSTR'):
-    global fgenerator
-    try:
-        fgenerator = rm.open_resource(port)
+def open_port(address = None):
+    # use another address; it is identified when its session is first opened
+    global port
+    if address is not None:
+        port = address
+    visa_sessions.checks[port] = identify
 
-        # write("++mode 1")    # put Prologix in controller mode
-        # write("++auto 0")    # turn off Prologix Read-After-Write mode
-        # write("++addr 11")  # set GPIB address to the AFG3021B
-        # write("*RST")        # Reset instrument
+def identify(fgenerator):
+    try:
+        # fgenerator.write("++mode 1")    # put Prologix in controller mode
+        # fgenerator.write("++auto 0")    # turn off Prologix Read-After-Write mode
+        # fgenerator.write("++addr 11")  # set GPIB address to the AFG3021B
+        # fgenerator.write("*RST")        # Reset instrument
         device = fgenerator.query("*IDN?")      # ask instrument to identify itself
-        write("++read 10")
+        fgenerator.write("++read 10")
 
         if not "TEKTRONIX,AFG3021" in device:
             print("Incompatible device")
@@ -24,59 +32,141 @@ def open_port(port = 'USB::0x0699::0x0340::C012268::INSTR'):
     except visa.VisaIOError:
         print("ERROR: Unable to connect to AFG3021 function generator.")
 
+open_port()
+
+# Last known settings, by SCPI header. Setters record what they queue and
+# getters answer from here; the instrument is only read for settings not
+# known yet, on sync(), or after a failed write has cleared the state.
+SETTINGS = ("FUNC", "FREQUENCY", "VOLTAGE:AMPLITUDE", "VOLTAGE:OFFSET")
+DEFAULTS = {"FUNC": "SIN", "FREQUENCY": 1E6,
+            "VOLTAGE:AMPLITUDE": 1.0, "VOLTAGE:OFFSET": 0.0}
+state = {}
+state_lock = threading.Lock()
+
+def remember(header, value):
+    with state_lock:
+        state[header] = value
+    return value
+
+def cached(header):
+    # last known value without touching the instrument, for rendering
+    with state_lock:
+        return state.get(header, DEFAULTS[header])
+
+def invalidate(error = None):
+    with state_lock:
+        state.clear()
+
+def setting(header):
+    with state_lock:
+        if header in state:
+            return state[header]
+    try:
+        value = parse(header, query(header + "?"))
+    except visa.VisaIOError:
+        invalidate()
+        raise
+    return remember(header, value)
+
+def sync():
+    # re-read every setting in a single round trip
+    try:
+        values = query(";:".join(header + "?" for header in SETTINGS)).split(";")
+    except visa.VisaIOError:
+        invalidate()
+        raise
+    with state_lock:
+        state.clear()
+        for header, value in zip(SETTINGS, values):
+            state[header] = parse(header, value)
+    return dict(state)
+
+def parse(header, value):
+    value = value.strip()
+    if header == "FUNC":
+        return value
+    return float(value)
+
+# Settings are queued and sent off the calling thread; rapid changes to the
+# same setting are coalesced and several settings go out in one write.
+# Listeners are called with each message once it reached the instrument.
+listeners = []
+
+def sent(message):
+    for listener in list(listeners):
+        listener(message)
+
+commands = CommandQueue(lambda message: write(message), on_error=invalidate, on_sent=sent)
+
 def set_amplitude(amplitude):
     amplitude = isnumber(amplitude)
-    if amplitude:
-        offset = float(fgenerator.query("VOLTAGE:OFFSET?"))    # read present offset voltage
+    if amplitude is not False:
+        remember("VOLTAGE:AMPLITUDE", amplitude)
+        commands.put("VOLTAGE:AMPLITUDE", lambda: amplitude_command(amplitude))
+
+def amplitude_command(amplitude):
+    offset = get_offset()
 
-        if (amplitude < 10e-3):
-            print('Warning: The minimum peak to peak amplitude for the AFG3021B '\
-            'is 10 mV.')
-        # # amplitude = 10e-3
-        if (abs(amplitude/2) + abs(offset) > 5):
-            print('Warning: The offset plus peak amplitude for the AFG3021B '\
-            'cannot exceed +/-5 V.')
-            amplitude = 2*(5 - abs(offset))
+    if (amplitude < 10e-3):
+        print('Warning: The minimum peak to peak amplitude for the AFG3021B '\
+        'is 10 mV.')
+    # # amplitude = 10e-3
+    if (abs(amplitude/2) + abs(offset) > 5):
+        print('Warning: The offset plus peak amplitude for the AFG3021B '\
+        'cannot exceed +/-5 V.')
+        amplitude = remember("VOLTAGE:AMPLITUDE", 2*(5 - abs(offset)))
 
-        write("VOLTAGE:AMPLITUDE " + str(amplitude))
+    return "VOLTAGE:AMPLITUDE " + str(amplitude)
 
 def set_offset(offset):
     offset = isnumber(offset)
-    if offset:
-        write("VOLTAGE:AMPLITUDE?")      # read present amplitude
+    if offset is not False:
+        remember("VOLTAGE:OFFSET", offset)
+        commands.put("VOLTAGE:OFFSET", lambda: offset_command(offset))
 
-        if (abs(amplitude/2) + abs(offset) > 5):
-            print('Warning: The offset plus peak amplitude for the AFG3021 '\
-            'cannot exceed +/-5 V.')
+def offset_command(offset):
+    amplitude = get_amplitude()
+
+    if (abs(amplitude/2) + abs(offset) > 5):
+        print('Warning: The offset plus peak amplitude for the AFG3021 '\
+        'cannot exceed +/-5 V.')
         if (offset > 0):
             offset = 5 - amplitude/2
         else:
             offset = amplitude/2 - 5
-        write("VOLTAGE:OFFSET " + str(offset))
+        remember("VOLTAGE:OFFSET", offset)
+    return "VOLTAGE:OFFSET " + str(offset)
 
 def get_offset():
-    return fgenerator.query("VOLTAGE:OFFSET?")
+    return setting("VOLTAGE:OFFSET")
 
 def get_frequency():
-    # read present offset voltage
-    return fgenerator.query("FREQUENCY?")
+    return setting("FREQUENCY")
 
 def get_amplitude():
-    return fgenerator.query("VOLTAGE:AMPLITUDE?")
+    return setting("VOLTAGE:AMPLITUDE")
 
 def set_frequency(frequency):
-    write("FREQUENCY " + str(frequency))
+    remember("FREQUENCY", float(frequency))
+    commands.put("FREQUENCY", "FREQUENCY " + str(frequency))
 
 def set_wave(wave):
     if wave in ['SIN', 'SQUARE', 'RAMP', 'PULSE']:
-        write("FUNC " + wave)
+        remember("FUNC", wave)
+        commands.put("FUNC", "FUNC " + wave)
+
+def get_wave():
+    return setting("FUNC")
+
+def flush(timeout = None):
+    # wait for queued settings to reach the instrument
+    return commands.flush(timeout)
 
-# CHECK THIS - not tested
-def get_wave(wave):
-    return fgenerator.query("FUNC?")
+def query(command):
+    return visa_sessions.run(port, lambda fgenerator: fgenerator.query(command))
 
 def write(command):
-    fgenerator.write(command)
+    visa_sessions.run(port, lambda fgenerator: fgenerator.write(command))
 
 def enable_output():
   write("OUTP ON")
@@ -92,7 +182,7 @@ def toggle():
         enable_output()
 
 def get_output():
-  return fgenerator.query("OUTP?")
+  return query("OUTP?")
 
 def isnumber(str):
     try:
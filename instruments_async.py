@@ -0,0 +1,95 @@
+import asyncio
+import functools
+
+import fgen_afg3021 as fgen
+import osc_tds350 as osc
+import visa_sessions
+
+# asyncio front end for the instrument drivers.
+#
+# Every blocking VISA call runs on the executor lane of its instrument
+# (visa_sessions.lane), so calls to one instrument stay in order while the
+# oscilloscope (GPIB) and the function generator (USB) work concurrently:
+#
+#     x, y = await instruments_async.acquire()
+#     await asyncio.gather(instruments_async.acquire(),
+#                          instruments_async.set_frequency(1e6))
+
+
+def run(address, function, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(visa_sessions.lane(address),
+                                functools.partial(function, *args, **kwargs))
+
+
+# Oscilloscope
+
+async def acquire(out=None):
+    # without out, y is copied out of the driver's shared buffer before the
+    # instrument is released, so concurrent awaits each get their own array
+    if out is None:
+        return await run(osc.ADDRESS, osc.get_data_tuple)
+    return await run(osc.ADDRESS, osc.acquire, out)
+
+
+async def get_data_tuple():
+    return await run(osc.ADDRESS, osc.get_data_tuple)
+
+
+async def osc_query(command):
+    return await run(osc.ADDRESS, osc.query, command)
+
+
+async def osc_write(command):
+    await run(osc.ADDRESS, osc.write, command)
+
+
+# Function generator; setters return once the setting reached the instrument
+
+async def set_setting(setter, value):
+    setter(value)
+    await run(fgen.port, fgen.flush)
+
+
+async def set_frequency(frequency):
+    await set_setting(fgen.set_frequency, frequency)
+
+
+async def set_amplitude(amplitude):
+    await set_setting(fgen.set_amplitude, amplitude)
+
+
+async def set_offset(offset):
+    await set_setting(fgen.set_offset, offset)
+
+
+async def set_wave(wave):
+    await set_setting(fgen.set_wave, wave)
+
+
+async def get_frequency():
+    return await run(fgen.port, fgen.get_frequency)
+
+
+async def get_amplitude():
+    return await run(fgen.port, fgen.get_amplitude)
+
+
+async def get_offset():
+    return await run(fgen.port, fgen.get_offset)
+
+
+async def get_wave():
+    return await run(fgen.port, fgen.get_wave)
+
+
+async def sync():
+    return await run(fgen.port, fgen.sync)
+
+
+async def fgen_query(command):
+    return await run(fgen.port, fgen.query, command)
+
+
+async def fgen_write(command):
+    await run(fgen.port, fgen.write, command)
@@ -0,0 +1,89 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Automatic measurements of acquired or synthesized traces.
+#
+# Levels come from the trace itself: edges are found with a Schmitt trigger
+# between 10% and 90% of the min..max span, so noise around the middle of
+# an edge does not count as extra crossings. Rise and fall times are the
+# 10%-90% transition times, frequency and duty cycle are taken over the
+# whole periods between the first and last rising edge. All channels of a
+# (channels, samples) stack are measured together. Values that cannot be
+# measured (no edges, less than one period) are NaN.
+
+Measurements = namedtuple('Measurements', ['vpp', 'mean', 'rms', 'frequency', 'period',
+                                           'duty', 'rise', 'fall'])
+
+PREFIXES = [(1e9, 'G'), (1e6, 'M'), (1e3, 'k'), (1, ''), (1e-3, 'm'), (1e-6, 'u'),
+            (1e-9, 'n'), (1e-12, 'p')]
+
+
+def measure(x, y):
+    # Measurements of a trace, or a list with one per row of a stack
+    if np.ndim(y) == 1:
+        return measure(x, np.asarray(y)[np.newaxis])[0]
+    y = np.asarray(y, dtype=np.float64)
+    x = np.asarray(x)
+    samples = y.shape[1]
+
+    low = y.min(axis=1)
+    high = y.max(axis=1)
+    mean = y.mean(axis=1)
+    rms = np.sqrt(np.einsum('ij,ij->i', y, y) / samples)
+    span = (high - low)[:, np.newaxis]
+    middle = low[:, np.newaxis] + 0.5 * span
+
+    # Schmitt trigger state: 0 below 10%, 1 above 90%, held in between;
+    # holder is the index of the last sample outside the band
+    below = y < low[:, np.newaxis] + 0.1 * span
+    above = y > low[:, np.newaxis] + 0.9 * span
+    outside = below | above
+    holder = np.where(outside, np.arange(samples), 0)
+    np.maximum.accumulate(holder, axis=1, out=holder)
+    rows = np.arange(len(y))[:, np.newaxis]
+    state = above[rows, holder]
+    change = np.diff(state.view(np.int8), axis=1)
+    over_middle = y > middle
+
+    results = []
+    for row in range(len(y)):
+        x_row = x[row] if x.ndim == 2 else x
+        # first sample past the 90% (10%) level of each rising (falling) edge
+        rising = np.flatnonzero(change[row] == 1) + 1
+        falling = np.flatnonzero(change[row] == -1) + 1
+        rise = fall = period = duty = np.nan
+        if len(rising):
+            # back to the last sample still below 10%
+            rise = np.mean(x_row[rising] - x_row[holder[row, rising - 1]])
+        if len(falling):
+            fall = np.mean(x_row[falling] - x_row[holder[row, falling - 1]])
+        if len(rising) > 1:
+            first, last = rising[0], rising[-1]
+            period = (x_row[last] - x_row[first]) / (len(rising) - 1)
+            duty = np.count_nonzero(over_middle[row, first:last]) / (last - first)
+        results.append(Measurements(vpp=high[row] - low[row], mean=mean[row], rms=rms[row],
+                                    frequency=1 / period if period else np.nan,
+                                    period=period, duty=duty, rise=rise, fall=fall))
+    return results
+
+
+def si(value, unit):
+    # 1.5e-08, 's' -> '15 ns'
+    if not np.isfinite(value):
+        return '-'
+    value = float('{:.3g}'.format(value))
+    factor, prefix = next(((factor, prefix) for factor, prefix in PREFIXES
+                           if abs(value) >= factor), (1, ''))
+    return '{:.3g} {}{}'.format(value / factor, prefix, unit)
+
+
+def describe(measurements, unit='V', name=None):
+    # one line for graph info
+    m = measurements
+    text = ('Vpp {:.3g} {unit} | mean {:.3g} {unit} | RMS {:.3g} {unit} | {} | '
+            'duty {} | rise {} | fall {}').format(
+        m.vpp, m.mean, m.rms, si(m.frequency, 'Hz'),
+        '-' if np.isnan(m.duty) else '{:.1f} %'.format(100 * m.duty),
+        si(m.rise, 's'), si(m.fall, 's'), unit=unit)
+    return text if name is None else '{}: {}'.format(name, text)
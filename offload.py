@@ -0,0 +1,177 @@
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory     # Python >= 3.8
+except ImportError:
+    shared_memory = None
+
+# Process pool for CPU heavy waveform work (synthesis, FFTs, measurements).
+#
+# Work run here leaves the GIL of the web worker free, so one large record
+# does not stall every other callback of the worker while it is processed.
+# OFFLOAD_WORKERS sets the number of processes per web worker; 0 (default)
+# runs everything in the calling thread. The pool is created on first use,
+# after gunicorn has forked its workers.
+#
+# Pool processes are started from a fork server (spawned where there is
+# none), not forked from the web worker: by then that runs the acquisition
+# and command queue threads, and a lock one of them holds at the fork would
+# stay locked in the child. Functions sent to the pool are therefore looked
+# up by importing their module, which must have no side effects (no Dash
+# app, instrument or database opened at import).
+#
+# Large arrays in the arguments and in the result (also inside tuples, lists
+# and dicts) are passed through multiprocessing.shared_memory: the sender
+# copies an array once into a shared block and the receiver maps it, instead
+# of both sides pickling it through a pipe. Without shared_memory (Python
+# before 3.8) arrays are pickled like any other value.
+
+MIN_SHARED_BYTES = 1 << 16      # smaller arrays are cheaper to pickle
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() \
+    else 'spawn'
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def workers():
+    return int(os.environ.get('OFFLOAD_WORKERS', '0'))
+
+
+def executor():
+    global pool
+    with pool_lock:
+        if pool is None and workers() > 0:
+            if shared_memory is not None:
+                # pool processes must report their blocks to this process's
+                # tracker, not start their own that unlinks them on exit
+                resource_tracker.ensure_running()
+            if sys.version_info >= (3, 7):
+                pool = ProcessPoolExecutor(max_workers=workers(),
+                                           mp_context=multiprocessing.get_context(START_METHOD))
+            else:
+                # Python 3.6 pools take the default start method
+                multiprocessing.set_start_method(START_METHOD, force=True)
+                pool = ProcessPoolExecutor(max_workers=workers())
+        return pool
+
+
+class Shared:
+    # picklable reference to an array copied into a shared memory block
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.name = self.memory.name
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        np.ndarray(self.shape, self.dtype, buffer=self.memory.buf)[...] = array
+
+    def __getstate__(self):
+        return self.name, self.shape, self.dtype
+
+    def __setstate__(self, state):
+        self.name, self.shape, self.dtype = state
+        self.memory = None
+
+    def attach(self):
+        # view on the block; it stays mapped while the view is referenced
+        self.memory = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, self.dtype, buffer=self.memory.buf)
+
+    def close(self):
+        try:
+            self.memory.close()
+        except BufferError:
+            # a view is still referenced; the mapping goes with it
+            pass
+
+    def release(self):
+        self.close()
+        self.memory.unlink()
+
+
+def walk(value, convert):
+    # value with convert() applied to every item inside tuples (named or
+    # not), lists and dicts
+    if isinstance(value, (tuple, list)):
+        items = [walk(item, convert) for item in value]
+        return type(value)(*items) if hasattr(value, '_fields') else type(value)(items)
+    if isinstance(value, dict):
+        return {key: walk(item, convert) for key, item in value.items()}
+    return convert(value)
+
+
+def share(value, blocks):
+    # value with its large arrays replaced by Shared blocks, added to blocks
+    def convert(item):
+        if isinstance(item, np.ndarray) and item.nbytes >= MIN_SHARED_BYTES \
+                and not item.dtype.hasobject:
+            blocks.append(Shared(item))
+            return blocks[-1]
+        return item
+    return value if shared_memory is None else walk(value, convert)
+
+
+def attach(value, blocks):
+    # inverse of share(): views on the blocks, which are added to blocks
+    def convert(item):
+        if isinstance(item, Shared):
+            blocks.append(item)
+            return item.attach()
+        return item
+    return walk(value, convert)
+
+
+def copy_out(value):
+    # arrays that may view a shared block, copied so the block can go
+    def convert(item):
+        if isinstance(item, np.ndarray) and not item.flags.owndata:
+            return item.copy()
+        return item
+    return walk(value, convert)
+
+
+def call(function, args, kwargs):
+    # runs in a pool process
+    blocks = []
+    result = function(*attach(args, blocks), **attach(kwargs, blocks))
+    if blocks:
+        # the result must not keep the argument blocks mapped
+        result = copy_out(result)
+    for block in blocks:
+        block.close()
+    return share(result, [])
+
+
+def run(function, *args, **kwargs):
+    # function(*args, **kwargs) in the pool, or in this thread without one;
+    # function must be defined at module level so the pool can find it
+    global pool
+    executor_ = executor()
+    if executor_ is None:
+        return function(*args, **kwargs)
+    blocks = []
+    try:
+        future = executor_.submit(call, function, share(args, blocks), share(kwargs, blocks))
+        result = future.result()
+    except BrokenProcessPool:
+        # a pool process died; start a new pool on the next call
+        with pool_lock:
+            if pool is executor_:
+                pool = None
+        raise
+    finally:
+        for block in blocks:
+            block.release()
+    returned = []
+    result = copy_out(attach(result, returned))
+    for block in returned:
+        block.release()
+    return result
@@ -1,75 +1,310 @@
-import visa
+import re
+import time
+from collections import namedtuple
+from functools import lru_cache
+
 import numpy as np
 
-oscilloscope = None
+import visa_sessions
+
+ADDRESS = "GPIB0::1::INSTR"
 
 # Adapted from code seen here:
 # https://github.com/baroobob/TektronixTDS2024B/blob/master/TektronixTDS2024B.py
 
-def get_data():
-    global oscilloscope
-    rm = visa.ResourceManager()
-    oscilloscope = rm.open_resource("GPIB0::1::INSTR")
+Preamble = namedtuple('Preamble', ['ymult', 'yzero', 'yoff', 'xincr', 'points'])
 
-    write("DATA:SOURCE CH1")
-    write("DATA:WIDTH 2")
-    write("DATa:ENCdg SRIbinary")
+source = 'CH1'
+configured = None        # session the DATA:* settings were sent on
+preambles = {}           # source -> Preamble, dropped when a setting changes
+autoset_pending = None   # time of the last AUTOSET request not yet run
+AUTOSET_SETTLE = 0.5     # seconds without new requests before it runs
+capture_error = None     # last error of a capture callback, reported once
+scaled = np.empty(0, dtype=np.float32)
 
-    ymult = float(query("WFMPRE:CH1:YMULT?"))
-    yzero = float(query("WFMPRE:CH1:YZERO?"))
-    yoff = float(query('WFMPRE:CH1:YOFF?'))
-    xincr = float(query('WFMPRE:CH1:XINCR?'))
+def split_fields(text):
+    # split a SCPI response on ';' while keeping quoted strings intact
+    return re.findall(r'(?:[^;"]|"[^"]*")+', text)
 
-    write('AUTOSET EXECUTE')
+def parse_preamble(text):
+    # Parse a HEADER ON / VERBOSE ON 'WFMPRE?' response such as
+    #   :WFMPRE:BYT_NR 2;...;:WFMPRE:CH1:WFID "Ch1, ...";NR_PT 2500;...
+    # into {source: {keyword: value}}. Entries without a leading ':' share
+    # the path of the previous entry.
+    fields = {}
+    path = []
+    for item in split_fields(text.strip()):
+        header, _, value = item.strip().partition(' ')
+        keys = header.upper().split(':')
+        if header.startswith(':'):
+            path = keys[1:-1]
+        else:
+            keys = path + keys
+        channel = path[1] if len(path) > 1 else None
+        fields.setdefault(channel, {})[keys[-1]] = value.strip().strip('"')
+    return fields
 
-    write("CURVE?")
-    data = oscilloscope.read_raw()
-    headerlen = 2 + int(data[1])
-    header = data[:headerlen]
-    ADC_wave = data[headerlen:-1]
-    ADC_wave = np.fromstring(ADC_wave, dtype = np.int16)
+def read_preambles(oscilloscope, channels):
+    # preambles of all channels in one round trip; DATA:SOURCE is restored
+    message = ";:".join("DATA:SOURCE {};:WFMPRE?".format(channel) for channel in channels)
+    oscilloscope.write("HEADER ON;:VERBOSE ON")
+    try:
+        fields = parse_preamble(oscilloscope.query(message + ";:DATA:SOURCE " + source))
+    finally:
+        oscilloscope.write("HEADER OFF")
+    result = {}
+    for channel in channels:
+        values = fields.get(channel, {})
+        try:
+            result[channel] = Preamble(ymult=float(values['YMULT']),
+                                       yzero=float(values['YZERO']),
+                                       yoff=float(values['YOFF']),
+                                       xincr=float(values['XINCR']),
+                                       points=int(values['NR_PT']))
+        except KeyError:
+            # the scope only describes waveforms that are displayed
+            raise ValueError("no waveform on {}; is the channel turned on?"
+                             .format(channel)) from None
+    return result
 
-    y = (ADC_wave - yoff) * ymult  + yzero
-    x = np.arange(0, xincr * len(y), xincr)
+def setup(oscilloscope):
+    global configured
+    oscilloscope.write("HEADER OFF")
+    oscilloscope.write("DATA:SOURCE " + source)
+    oscilloscope.write("DATA:WIDTH 2")
+    oscilloscope.write("DATa:ENCdg SRIbinary")
+    configured = oscilloscope
+    preambles.clear()
 
-    oscilloscope.close()
+def set_source(channel):
+    global source, configured
+    with visa_sessions.lock(ADDRESS):
+        if channel != source:
+            source = channel
+            configured = None
 
-    return [{'x': x,
-             'y': y,
-             'type': 'line',
-             'showscale': False,
-             'colorscale': [[0, 'rgba(255, 255, 255,0)'], [1, 'rgba(0,0,255,1)']]}]
+def autoset():
+    # run AUTOSET before an acquisition instead of on every shot; requests
+    # made while a knob is dragged are merged into one, run once they settle
+    global autoset_pending
+    autoset_pending = time.time()
 
-def get_data_tuple():
-    global oscilloscope
-    rm = visa.ResourceManager()
-    oscilloscope = rm.open_resource("GPIB0::1::INSTR")
+def invalidate():
+    # call after changing vertical/horizontal settings on the scope
+    preambles.clear()
+
+def prepare(oscilloscope):
+    global autoset_pending
+    if configured is not oscilloscope:
+        setup(oscilloscope)
+    if autoset_pending is not None and time.time() - autoset_pending >= AUTOSET_SETTLE:
+        autoset_pending = None
+        oscilloscope.write('AUTOSET EXECUTE')
+        preambles.clear()
+
+def preamble(oscilloscope, channels=None):
+    # cached preamble of source, or {channel: preamble} for several channels
+    prepare(oscilloscope)
+    missing = [channel for channel in channels or [source] if channel not in preambles]
+    if missing:
+        preambles.update(read_preambles(oscilloscope, missing))
+    if channels is None:
+        return preambles[source]
+    return {channel: preambles[channel] for channel in channels}
+
+def decode_block(data, start=0):
+    # Return the int16 samples of the IEEE 488.2 binary block
+    # ('#' <digits> <length> <payload>) found from start, as a view on data
+    # without copying, and the index just past the block.
+    # SRIbinary is signed, least significant byte first.
+    start = data.index(b'#', start)
+    digits = int(data[start + 1:start + 2])
+    if digits:
+        length = int(data[start + 2:start + 2 + digits])
+    else:
+        # indefinite length block runs up to the terminating newline
+        length = len(data) - start - 2 - data.endswith(b'\n')
+    offset = start + 2 + digits
+    codes = np.frombuffer(data, dtype='<i2', count=length // 2, offset=offset)
+    return codes, offset + length
+
+@lru_cache(maxsize=16)
+def time_axis(xincr, points):
+    x = np.arange(points) * xincr
+    x.flags.writeable = False
+    return x
+
+def scale(codes, pre, out):
+    np.subtract(codes, pre.yoff, out=out, casting='unsafe')
+    out *= pre.ymult
+    out += pre.yzero
+    return out
+
+def buffer(*shape):
+    # reusable float32 buffer for acquisitions without a caller supplied one
+    global scaled
+    if scaled.shape != shape:
+        scaled = np.empty(shape, dtype=np.float32)
+    return scaled
+
+def read_waveform(oscilloscope, out=None):
+    pre = preamble(oscilloscope)
+
+    oscilloscope.write("CURVE?")
+    codes, _ = decode_block(oscilloscope.read_raw())
+
+    if len(codes) != pre.points:
+        # record length changed behind our back; rescale with fresh values
+        preambles.pop(source, None)
+        pre = preamble(oscilloscope)
 
-    write("DATA:SOURCE CH1")
-    write("DATA:WIDTH 2")
-    write("DATa:ENCdg SRIbinary")
+    if out is None or len(out) != len(codes):
+        out = buffer(len(codes))
+    return time_axis(pre.xincr, len(codes)), scale(codes, pre, out)
 
-    ymult = float(query("WFMPRE:CH1:YMULT?"))
-    yzero = float(query("WFMPRE:CH1:YZERO?"))
-    yoff = float(query('WFMPRE:CH1:YOFF?'))
-    xincr = float(query('WFMPRE:CH1:XINCR?'))
+def acquire(out=None):
+    # The returned y is written into out when it has the record length,
+    # otherwise into a module buffer that is overwritten by the next
+    # acquire() call. x is cached and read-only.
+    return visa_sessions.run(ADDRESS, lambda oscilloscope: read_waveform(oscilloscope, out))
 
-    write('AUTOSET EXECUTE')
+def read_channels(oscilloscope, channels, out=None, capture=None):
+    # every channel's curve in one message; the responses come back as
+    # ';'-separated binary blocks in the order requested. capture, when
+    # given, is called with the raw codes before they are scaled.
+    pres = preamble(oscilloscope, channels)
 
-    write("CURVE?")
+    oscilloscope.write(";:".join("DATA:SOURCE {};:CURVE?".format(channel)
+                                 for channel in channels) + ";:DATA:SOURCE " + source)
     data = oscilloscope.read_raw()
-    headerlen = 2 + int(data[1])
-    header = data[:headerlen]
-    ADC_wave = data[headerlen:-1]
-    ADC_wave = np.fromstring(ADC_wave, dtype = np.int16)
+    blocks = []
+    end = 0
+    for channel in channels:
+        codes, end = decode_block(data, end)
+        blocks.append(codes)
 
-    y = (ADC_wave - yoff) * ymult  + yzero
-    x = np.arange(0, xincr * len(y), xincr)
-    return (x, y)
+    points = len(blocks[0])
+    if any(len(codes) != pres[channel].points for channel, codes in zip(channels, blocks)):
+        for channel in channels:
+            preambles.pop(channel, None)
+        pres = preamble(oscilloscope, channels)
+    if capture is not None:
+        capture(channels, blocks, pres)
+
+    if out is None or out.shape != (len(channels), points):
+        out = buffer(len(channels), points)
+    for row, channel, codes in zip(out, channels, blocks):
+        scale(codes, pres[channel], row)
+    return time_axis(pres[channels[0]].xincr, points), out
+
+def acquire_channels(channels=('CH1',), out=None, capture=None):
+    # Acquire several sources (CH1, CH2, MATH) together as a stacked
+    # (channels, samples) array, with the same buffer rules as acquire().
+    # capture(channels, codes, preambles) sees the int16 curve of each
+    # channel, e.g. capture_log.CaptureLog.append. It is called once the
+    # instrument is released, and its errors are reported without failing
+    # the acquisition.
+    channels = list(channels)
+    frames = []
+    keep = None if capture is None else lambda *frame: frames.append(frame)
+    x, y = visa_sessions.run(
+        ADDRESS, lambda oscilloscope: read_channels(oscilloscope, channels, out, keep))
+    if frames:
+        log_frame(capture, frames[-1])
+    return x, y
+
+def log_frame(capture, frame):
+    global capture_error
+    try:
+        capture(*frame)
+    except Exception as error:
+        if capture_error is None:
+            print("ERROR: capture failed: {}".format(error))
+        capture_error = error
+    else:
+        capture_error = None
+
+def read_block(oscilloscope, buffers, chunk_size):
+    # Read the binary block of a CURVE? response into buffers['raw'] in
+    # chunks of chunk_size bytes and return a view on its payload. The
+    # buffer is only replaced when a longer record arrives.
+    while oscilloscope.read_bytes(1) != b'#':
+        pass
+    digits = int(oscilloscope.read_bytes(1))
+    if digits:
+        length = int(oscilloscope.read_bytes(digits))
+    else:
+        # indefinite length block runs up to the terminating newline, so
+        # the rest of the message is read at once
+        rest = oscilloscope.read_raw()
+        length = len(rest) - rest.endswith(b'\n')
+    if len(buffers['raw']) < length:
+        buffers['raw'] = bytearray(length)
+    view = memoryview(buffers['raw'])[:length]
+    if not digits:
+        view[:] = rest[:length]
+        return view
+    received = 0
+    while received < length:
+        chunk = oscilloscope.read_bytes(min(chunk_size, length - received))
+        view[received:received + len(chunk)] = chunk
+        received += len(chunk)
+    oscilloscope.read_bytes(1)      # message terminator
+    return view
+
+def read_stream_frame(oscilloscope, buffers, chunk_size):
+    pre = preamble(oscilloscope)
+
+    oscilloscope.write("CURVE?")
+    codes = np.frombuffer(read_block(oscilloscope, buffers, chunk_size), dtype='<i2')
+
+    if len(codes) != pre.points:
+        preambles.pop(source, None)
+        pre = preamble(oscilloscope)
+    if len(buffers['y']) != len(codes):
+        buffers['y'] = np.empty(len(codes), dtype=np.float32)
+    return time_axis(pre.xincr, len(codes)), scale(codes, pre, buffers['y'])
+
+def stream(frames=None, chunk_size=65536):
+    # Yield consecutive (x, y) records, forever or for the given number of
+    # frames. Each record is read in chunks into buffers that are reused for
+    # the whole stream, so y is overwritten by the next frame: copy what you
+    # keep. The next CURVE? is only sent when the consumer asks for it, and
+    # the instrument is free for other callers between frames.
+    buffers = {'raw': bytearray(0), 'y': np.empty(0, dtype=np.float32)}
+    count = 0
+    while frames is None or count < frames:
+        yield visa_sessions.run(
+            ADDRESS, lambda oscilloscope: read_stream_frame(oscilloscope, buffers, chunk_size))
+        count += 1
+
+def trace(x, y, names=None):
+    # one trace per row of a (channels, samples) y
+    if np.ndim(y) == 1:
+        return trace(x, [y], names)
+    if np.ndim(x) == 1:
+        x = [x] * len(y)
+    return [{'x': row_x,
+             'y': row_y,
+             'name': names[index] if names else None,
+             'type': 'line',
+             'showscale': False,
+             'colorscale': [[0, 'rgba(255, 255, 255,0)'], [1, 'rgba(0,0,255,1)']]}
+            for index, (row_x, row_y) in enumerate(zip(x, y))]
+
+def get_data():
+    return trace(*get_data_tuple())
+
+def get_data_tuple():
+    # y is copied out of the shared buffer while the instrument is still
+    # held, before another acquisition can scale into it
+    def read(oscilloscope):
+        x, y = read_waveform(oscilloscope)
+        return (x, y.copy())
+    return visa_sessions.run(ADDRESS, read)
 
 def query(command):
-    return oscilloscope.query(command)
+    return visa_sessions.run(ADDRESS, lambda oscilloscope: oscilloscope.query(command))
 
 def write(command):
-    oscilloscope.write(command)
-#page 204
+    visa_sessions.run(ADDRESS, lambda oscilloscope: oscilloscope.write(command))
@@ -0,0 +1,82 @@
+import numpy as np
+
+# Min/max pyramid of a trace for zoomed-out views.
+#
+# Level k holds, for every complete bucket of FACTOR**k samples, the index
+# of its min and of its max sample. Level k+1 is built from level k only, so
+# extending a growing series costs the new samples plus a third of them.
+# A view of n samples reads the coarsest level that still has more than
+# width buckets in the window, about width * FACTOR candidates instead of n,
+# and scans only the partial buckets at the window edges at full resolution.
+
+FACTOR = 4
+
+
+class Pyramid:
+    def __init__(self, y=None, factor=FACTOR):
+        self.factor = factor
+        self.levels = []        # [(low indices, high indices)] for k = 1, 2, ...
+        self.length = 0         # samples covered by extend()
+        if y is not None:
+            self.extend(y)
+
+    def extend(self, y):
+        # add the buckets completed by samples y[self.length:]; y is the whole
+        # series so far and must keep the samples already seen unchanged
+        factor = self.factor
+        size = 1
+        level = 0
+        while True:
+            size *= factor
+            done = len(self.levels[level][0]) if level < len(self.levels) else 0
+            start, stop = done * size, len(y) // size * size
+            if stop <= start:
+                break
+            if level == 0:
+                blocks = np.asarray(y[start:stop]).reshape(-1, factor)
+                starts = np.arange(start, stop, factor)
+                low = blocks.argmin(axis=1) + starts
+                high = blocks.argmax(axis=1) + starts
+            else:
+                below_low, below_high = self.levels[level - 1]
+                first, last = start // (size // factor), stop // (size // factor)
+                low = pick(y, below_low[first:last].reshape(-1, factor), np.argmin)
+                high = pick(y, below_high[first:last].reshape(-1, factor), np.argmax)
+            if level < len(self.levels):
+                self.levels[level] = (np.concatenate([self.levels[level][0], low]),
+                                      np.concatenate([self.levels[level][1], high]))
+            else:
+                self.levels.append((low, high))
+            level += 1
+        self.length = len(y)
+        return self
+
+    def indices(self, start, stop, width):
+        # sorted indices of y[start:stop] whose min/max decimation to width
+        # buckets equals that of the whole window
+        if stop - start <= 2 * width or not self.levels:
+            return np.arange(start, stop)
+        level = min(int(np.log((stop - start) / width) / np.log(self.factor)),
+                    len(self.levels))
+        if level < 1:
+            return np.arange(start, stop)
+        size = self.factor ** level
+        low, high = self.levels[level - 1]
+        first = -(-start // size)
+        last = max(min(stop // size, len(low)), first)
+        return np.sort(np.concatenate([np.arange(start, min(first * size, stop)),
+                                       low[first:last], high[first:last],
+                                       np.arange(max(last * size, start), stop)]))
+
+
+def pick(y, candidates, choose):
+    # the candidate of each row whose sample choose() selects
+    rows = choose(np.asarray(y)[candidates], axis=1)
+    return candidates[np.arange(len(candidates)), rows]
+
+
+def build(y, factor=FACTOR):
+    # one Pyramid per trace of a (channels, samples) stack
+    if np.ndim(y) == 1:
+        return Pyramid(y, factor)
+    return [Pyramid(row, factor) for row in y]
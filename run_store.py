@@ -0,0 +1,111 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+import numpy as np
+
+from cache import LRUCache
+
+# Server-side storage for runs (captured waveforms and generator settings).
+#
+# Runs live in an SQLite file shared by every worker process and survive
+# restarts; the most recently used ones are also kept decoded in memory.
+# A memory entry is only served while its version matches the one on disk,
+# so a run updated by another worker is read again. Runs not saved for
+# max_age seconds are deleted, so the file does not grow without bound.
+
+Run = namedtuple('Run', ['run_id', 'settings', 'info', 'x', 'y', 'version'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    version REAL NOT NULL,
+    settings TEXT,
+    info TEXT,
+    x BLOB,
+    y BLOB,
+    shape TEXT
+)
+"""
+
+INDEX = 'CREATE INDEX IF NOT EXISTS runs_version ON runs (version)'
+
+MAX_AGE = 30 * 24 * 3600    # seconds a run is kept after its last save
+PRUNE_INTERVAL = 3600       # seconds between deletes of expired runs
+
+
+def new_id():
+    return uuid.uuid4().hex
+
+
+class RunStore:
+    def __init__(self, path=None, memory_size=32, default='runs.sqlite3', max_age=MAX_AGE):
+        # path, else RUN_STORE_PATH, else default in the working directory
+        self.path = path or os.environ.get('RUN_STORE_PATH', default)
+        self.memory = LRUCache(memory_size)
+        self.max_age = max_age
+        self.pruned = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        with self.lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(SCHEMA)
+            self.db.execute(INDEX)
+
+    def save(self, run_id, settings=None, info=None, x=None, y=None):
+        x = None if x is None else np.asarray(x, dtype=np.float32)
+        y = None if y is None else np.asarray(y, dtype=np.float32)
+        run = Run(str(run_id), settings, info, x, y, time.time())
+        with self.lock, self.db:
+            self.db.execute(
+                'REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (run.run_id, run.version, json.dumps(settings), info,
+                 None if x is None else x.tobytes(),
+                 None if y is None else y.tobytes(),
+                 None if y is None else json.dumps(y.shape)))
+            if self.max_age is not None and run.version - self.pruned >= PRUNE_INTERVAL:
+                self.db.execute('DELETE FROM runs WHERE version < ?',
+                                (run.version - self.max_age,))
+                self.pruned = run.version
+        self.memory.put(run.run_id, run)
+        return run
+
+    def load(self, run_id):
+        run_id = str(run_id)
+        with self.lock:
+            row = self.db.execute('SELECT version FROM runs WHERE run_id = ?',
+                                  (run_id,)).fetchone()
+        if row is None:
+            self.memory.pop(run_id)
+            return None
+        run = self.memory.get(run_id)
+        if run is not None and run.version == row[0]:
+            return run
+
+        with self.lock:
+            row = self.db.execute(
+                'SELECT version, settings, info, x, y, shape FROM runs WHERE run_id = ?',
+                (run_id,)).fetchone()
+        if row is None:
+            return None
+        version, settings, info, x, y, shape = row
+        if x is not None:
+            x = np.frombuffer(x, dtype=np.float32)
+        if y is not None:
+            y = np.frombuffer(y, dtype=np.float32).reshape(json.loads(shape))
+        run = Run(run_id, json.loads(settings), info, x, y, version)
+        self.memory.put(run_id, run)
+        return run
+
+    def settings(self, run_id):
+        run = self.load(run_id)
+        return None if run is None else run.settings
+
+    def delete(self, run_id):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM runs WHERE run_id = ?', (str(run_id),))
+        self.memory.pop(str(run_id))
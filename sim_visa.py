@@ -0,0 +1,228 @@
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import visa
+
+# Simulated VISA backend for running and load testing app.py without a bench.
+#
+# Select it with VISA_BACKEND=sim. It emulates the subset of SCPI used by
+# fgen_afg3021 and osc_tds350: the generator keeps its settings, and the
+# scope digitizes the generator output into CURVE? binary blocks. Every
+# message costs SIM_VISA_LATENCY seconds (default 0.005) and binary reads are
+# throttled to SIM_VISA_BYTES_PER_SECOND (default 1e6, roughly GPIB speed).
+
+LATENCY = float(os.environ.get('SIM_VISA_LATENCY', 0.005))
+BYTES_PER_SECOND = float(os.environ.get('SIM_VISA_BYTES_PER_SECOND', 1e6))
+
+
+class Bench:
+    # what the generator is outputting, shared by the simulated instruments
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.function = 'SIN'
+        self.frequency = 1e6
+        self.amplitude = 1.0
+        self.offset = 0.0
+        self.output = 1
+
+    def signal(self, time_axis, source):
+        phase = 2 * np.pi * self.frequency * time_axis
+        if self.function == 'SQUARE':
+            wave = np.where(np.mod(phase, 2 * np.pi) < np.pi, 1.0, -1.0)
+        elif self.function == 'PULSE':
+            wave = np.where(np.mod(phase, 2 * np.pi) < 0.2 * np.pi, 1.0, -1.0)
+        elif self.function == 'RAMP':
+            wave = np.mod(phase, 2 * np.pi) / np.pi - 1.0
+        else:
+            wave = np.sin(phase)
+        volts = self.offset + self.amplitude / 2 * wave * self.output
+        if source == 'CH2':
+            # trigger output of the generator
+            volts = np.where(np.mod(phase, 2 * np.pi) < np.pi, 1.0, 0.0)
+        elif source == 'MATH':
+            volts = volts - np.where(np.mod(phase, 2 * np.pi) < np.pi, 1.0, 0.0)
+        return volts + np.random.normal(0, 0.002, len(time_axis))
+
+
+bench = Bench()
+
+
+def split_message(message):
+    # ('HEADER', 'argument') pairs of a ';'-joined message; ':' restarts the path
+    commands = []
+    for part in re.findall(r'(?:[^;"]|"[^"]*")+', message.strip()):
+        header, _, argument = part.strip().partition(' ')
+        commands.append((header.lstrip(':').upper(), argument.strip()))
+    return commands
+
+
+class Resource:
+    def __init__(self, address):
+        self.address = address
+        self.output = b''
+        self.closed = False
+
+    def handle(self, header, argument):
+        # return the response to a query, None for a command
+        raise NotImplementedError
+
+    def write(self, message):
+        time.sleep(LATENCY)
+        responses = []
+        for header, argument in split_message(message):
+            response = self.handle(header, argument)
+            if response is not None:
+                responses.append(response if isinstance(response, bytes)
+                                 else str(response).encode())
+        if responses:
+            self.output = b';'.join(responses) + b'\n'
+        return len(message)
+
+    def read_raw(self):
+        if not self.output:
+            time.sleep(LATENCY)
+            raise visa.VisaIOError(visa.constants.VI_ERROR_TMO)
+        data, self.output = self.output, b''
+        time.sleep(LATENCY + len(data) / BYTES_PER_SECOND)
+        return data
+
+    def read_bytes(self, count, chunk_size=None, break_on_termchar=False):
+        if len(self.output) < count:
+            time.sleep(LATENCY)
+            raise visa.VisaIOError(visa.constants.VI_ERROR_TMO)
+        data, self.output = self.output[:count], self.output[count:]
+        time.sleep(count / BYTES_PER_SECOND)
+        return data
+
+    def read(self):
+        return self.read_raw().decode().rstrip('\n')
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def close(self):
+        self.closed = True
+
+
+class AFG3021(Resource):
+    def handle(self, header, argument):
+        with bench.lock:
+            if header == '*IDN?':
+                return 'TEKTRONIX,AFG3021,C012268,SCPI:99.0 FV:1.1.2'
+            if header.startswith('++'):
+                return None
+            if header in ('FREQUENCY', 'FREQ'):
+                bench.frequency = float(argument)
+            elif header in ('FREQUENCY?', 'FREQ?'):
+                return '{:.6E}'.format(bench.frequency)
+            elif header in ('VOLTAGE:AMPLITUDE', 'VOLT:AMPL'):
+                bench.amplitude = float(argument)
+            elif header in ('VOLTAGE:AMPLITUDE?', 'VOLT:AMPL?'):
+                return '{:.4E}'.format(bench.amplitude)
+            elif header in ('VOLTAGE:OFFSET', 'VOLT:OFFS'):
+                bench.offset = float(argument)
+            elif header in ('VOLTAGE:OFFSET?', 'VOLT:OFFS?'):
+                return '{:.4E}'.format(bench.offset)
+            elif header == 'FUNC':
+                bench.function = argument.upper()
+            elif header == 'FUNC?':
+                return bench.function
+            elif header in ('OUTP', 'OUTPUT'):
+                bench.output = 1 if argument.upper() in ('ON', '1') else 0
+            elif header in ('OUTP?', 'OUTPUT?'):
+                return str(bench.output)
+        return None
+
+
+class TDS350(Resource):
+    points = 2500
+    xincr = 4.0E-8
+
+    def __init__(self, address):
+        Resource.__init__(self, address)
+        self.header = True
+        self.verbose = True
+        self.source = 'CH1'
+        self.ymult = {'CH1': 4.0E-5, 'CH2': 4.0E-5, 'MATH': 8.0E-5}
+
+    def preamble(self, source):
+        return {'WFID': '"{}, DC coupling, {:.1E} V/div, {:.1E} s/div, {} points, '
+                        'Sample mode"'.format(source.capitalize(),
+                                              self.ymult[source] * 25 * 256 / 10,
+                                              self.xincr * 250, self.points),
+                'NR_PT': self.points, 'PT_FMT': 'Y', 'XUNIT': '"s"',
+                'XINCR': '{:.3E}'.format(self.xincr), 'PT_OFF': 0,
+                'YUNIT': '"V"', 'YMULT': '{:.3E}'.format(self.ymult[source]),
+                'YOFF': '0.0E0', 'YZERO': '0.0E0'}
+
+    def wfmpre(self):
+        common = [('BYT_NR', 2), ('BIT_NR', 16), ('ENCDG', 'BIN'),
+                  ('BN_FMT', 'RI'), ('BYT_OR', 'LSB')]
+        channel = list(self.preamble(self.source).items())
+        if not self.header:
+            return ';'.join(str(value) for _, value in common + channel)
+        return ';'.join([':WFMPRE:{} {}'.format(*common[0])] +
+                        ['{} {}'.format(*item) for item in common[1:]] +
+                        [':WFMPRE:{}:{} {}'.format(self.source, *channel[0])] +
+                        ['{} {}'.format(*item) for item in channel[1:]])
+
+    def curve(self):
+        with bench.lock:
+            t = np.arange(self.points) * self.xincr + time.time() % 1e-3
+            volts = bench.signal(t, self.source)
+        codes = np.clip(np.round(volts / self.ymult[self.source]), -32768, 32767)
+        data = codes.astype('<i2').tobytes()
+        length = str(len(data)).encode()
+        return b'#' + str(len(length)).encode() + length + data
+
+    def autoset(self):
+        with bench.lock:
+            span = abs(bench.offset) + bench.amplitude / 2
+            period = 1.0 / bench.frequency if bench.frequency else 1e-3
+        for source in self.ymult:
+            self.ymult[source] = max(span, 1.0) * 1.25 / 25000
+        self.xincr = 2.5 * period / self.points
+
+    def handle(self, header, argument):
+        if header == '*IDN?':
+            return 'TEKTRONIX,TDS 350,0,CF:91.1CT FV:v1.16 TDS350:v1.00'
+        if header in ('HEADER', 'HEAD', 'HDR'):
+            self.header = argument.upper() in ('ON', '1')
+        elif header in ('VERBOSE', 'VERB'):
+            self.verbose = argument.upper() in ('ON', '1')
+        elif header in ('DATA:SOURCE', 'DAT:SOU'):
+            self.source = argument.upper()
+        elif header.startswith('DATA:') or header.startswith('DAT:'):
+            pass
+        elif header in ('WFMPRE?', 'WFMP?'):
+            return self.wfmpre()
+        elif header.startswith('WFMPRE:') and header.endswith('?'):
+            source, key = header[:-1].split(':')[1:]
+            value = self.preamble(source)[key]
+            return ':WFMPRE:{}:{} {}'.format(source, key, value) if self.header else value
+        elif header in ('AUTOSET', 'AUTOS'):
+            self.autoset()
+        elif header in ('CURVE?', 'CURV?'):
+            block = self.curve()
+            return b':CURVE ' + block if self.header else block
+        return None
+
+
+class ResourceManager:
+    def __init__(self, *args):
+        pass
+
+    def list_resources(self):
+        return ('GPIB0::1::INSTR', 'USB::0x0699::0x0340::C012268::INSTR')
+
+    def open_resource(self, address, **kwargs):
+        if address.startswith('GPIB'):
+            return TDS350(address)
+        return AFG3021(address)
+
+    def close(self):
+        pass
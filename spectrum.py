@@ -0,0 +1,109 @@
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    import scipy.fft as fft         # scipy >= 1.4
+except ImportError:
+    fft = np.fft
+
+# Amplitude spectra of oscilloscope traces.
+#
+# Windows and frequency axes are computed once per record length and kept
+# read-only; the FFT libraries cache their own plans per length. Averaging
+# keeps one running power accumulator per trace instead of the frames
+# themselves, so it costs one FFT per acquisition whatever the count.
+
+WINDOWS = ('hann', 'blackman', 'flattop', 'rectangular')
+
+FLATTOP = (0.21557895, 0.41663158, 0.277263158, 0.083578947, 0.006947368)
+
+
+@lru_cache(maxsize=16)
+def window(name, points):
+    # window scaled to unit coherent gain, so a full scale sine reads its
+    # amplitude whatever the window
+    if name == 'hann':
+        values = np.hanning(points)
+    elif name == 'blackman':
+        values = np.blackman(points)
+    elif name == 'flattop':
+        phase = 2 * np.pi * np.arange(points) / (points - 1)
+        values = sum((-1) ** k * a * np.cos(k * phase) for k, a in enumerate(FLATTOP))
+    elif name == 'rectangular':
+        values = np.ones(points)
+    else:
+        raise ValueError("unknown window {!r}".format(name))
+    values = (values / values.mean()).astype(np.float32)
+    values.flags.writeable = False
+    return values
+
+
+@lru_cache(maxsize=16)
+def frequencies(points, xincr):
+    f = np.fft.rfftfreq(points, xincr)
+    f.flags.writeable = False
+    return f
+
+
+def power(x, y, window_name='hann'):
+    # (frequencies, power) of a trace or of every row of a stack, power in
+    # V^2 of the sine amplitude at each frequency
+    y = np.asarray(y, dtype=np.float32)
+    points = y.shape[-1]
+    xincr = float(x[-1] - x[0]) / (points - 1)
+    spectrum = fft.rfft(y * window(window_name, points), axis=-1)
+    result = np.square(np.abs(spectrum))
+    result *= (2.0 / points) ** 2
+    result[..., 0] /= 4             # DC is not split between two bins
+    return frequencies(points, xincr), result
+
+
+def decibels(values):
+    # dBV of a power spectrum
+    return 10 * np.log10(np.maximum(values, 1e-20))
+
+
+def spectrum(x, y, window_name='hann'):
+    f, values = power(x, y, window_name)
+    return f, decibels(values)
+
+
+class Average:
+    # Running average of the power spectra of consecutive frames: linear up
+    # to count frames, exponential with the same weight after that
+    def __init__(self, count=8, window_name='hann'):
+        self.count = count
+        self.window_name = window_name
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.f = None
+        self.mean = None
+
+    def reset(self):
+        with self.lock:
+            self.mean = None
+
+    def add(self, x, y):
+        return self.add_power(*power(x, y, self.window_name))
+
+    def add_power(self, f, values):
+        # add a power() result computed elsewhere, e.g. in the offload pool
+        with self.lock:
+            if self.mean is None or self.mean.shape != values.shape \
+                    or not np.array_equal(self.f, f):
+                # first frame, or record length, channels or timebase changed
+                self.frames = 0
+                self.mean = np.zeros_like(values)
+                self.f = f
+            self.frames += 1
+            self.mean += (values - self.mean) / min(self.frames, self.count)
+            return self.frames
+
+    def latest(self):
+        # (frequencies, dBV) of the average so far, None before any frame
+        with self.lock:
+            if self.mean is None:
+                return None
+            return self.f, decibels(self.mean)
@@ -0,0 +1,94 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import visa
+
+# Long-lived VISA sessions shared by every thread of the process.
+#
+# Opening a resource costs more than a CURVE? transfer on the GPIB bus, so
+# each instrument address is opened once and kept open. Access to a session
+# is serialized with a per-address lock; a session that raised a VISA error
+# is closed and reopened on the next call. Each gunicorn worker process
+# holds its own sessions since VISA handles cannot cross process boundaries.
+#
+# VISA_BACKEND selects the VISA library: unset for the default, a pyvisa
+# backend such as '@py', or 'sim' for the simulated bench in sim_visa.
+
+rm = None
+sessions = {}
+locks = {}
+lanes = {}
+checks = {}         # address -> check(resource), run when it is first opened
+pool_lock = threading.Lock()
+
+
+def resource_manager():
+    global rm
+    with pool_lock:
+        if rm is None:
+            backend = os.environ.get('VISA_BACKEND', '')
+            if backend == 'sim':
+                import sim_visa
+                rm = sim_visa.ResourceManager()
+            else:
+                rm = visa.ResourceManager(backend)
+        return rm
+
+
+def lock(address):
+    with pool_lock:
+        if address not in locks:
+            locks[address] = threading.RLock()
+        return locks[address]
+
+
+def lane(address):
+    # single worker executor per instrument, used by instruments_async so
+    # calls to one instrument queue up while different instruments overlap
+    with pool_lock:
+        if address not in lanes:
+            lanes[address] = ThreadPoolExecutor(max_workers=1,
+                                                thread_name_prefix='visa-' + address)
+        return lanes[address]
+
+
+def get(address):
+    # caller must hold lock(address)
+    resource = sessions.get(address)
+    if resource is None:
+        resource = resource_manager().open_resource(address)
+        sessions[address] = resource
+        check = checks.pop(address, None)
+        if check is not None:
+            check(resource)
+    return resource
+
+
+def discard(address):
+    with lock(address):
+        resource = sessions.pop(address, None)
+        if resource is not None:
+            try:
+                resource.close()
+            except visa.VisaIOError:
+                pass
+
+
+def run(address, function, retries=1):
+    # Call function(resource) with exclusive access to the instrument,
+    # reopening the session and retrying if the bus drops it
+    with lock(address):
+        while True:
+            try:
+                return function(get(address))
+            except visa.VisaIOError:
+                discard(address)
+                if retries <= 0:
+                    raise
+                retries -= 1
+
+
+def close_all():
+    for address in list(sessions):
+        discard(address)
@@ -0,0 +1,69 @@
+from functools import lru_cache
+
+import numpy as np
+
+import measure
+import pyramid
+
+# Vectorized synthesis of the function generator waveforms for the mock app.
+#
+# Each waveform is computed in a single pass over one float64 array using
+# in-place ufuncs, so a trace costs one allocation regardless of its type
+# and scales to millions of samples.
+
+FUNCTION_TYPES = ('SIN', 'SQUARE', 'RAMP', 'PULSE')
+PULSE_DUTY = 0.1
+
+
+@lru_cache(maxsize=8)
+def time_axis(samples, start=-0.000045, stop=0.000045):
+    time = np.linspace(start, stop, samples)
+    time.flags.writeable = False
+    return time
+
+
+def square(phase, duty=0.5):
+    # same as scipy.signal.square, written into phase
+    np.mod(phase, 2 * np.pi, out=phase)
+    np.multiply(phase < 2 * np.pi * duty, 2.0, out=phase)
+    phase -= 1.0
+    return phase
+
+
+def synthesize(function_type, frequency, amplitude, offset, time):
+    frequency, amplitude, offset = float(frequency), float(amplitude), float(offset)
+    if function_type not in FUNCTION_TYPES:
+        raise ValueError("Unknown function type: {}".format(function_type))
+
+    if function_type == 'SIN':
+        # the generator knob value is interpreted in degrees
+        y = np.multiply(time, np.radians(2.0 * np.pi * frequency))
+        np.sin(y, out=y)
+        y *= amplitude
+        y += offset
+        return y
+
+    y = np.multiply(time, 2.0 * np.pi * frequency / 10)
+    if function_type == 'SQUARE':
+        square(y)
+    elif function_type == 'PULSE':
+        square(y, PULSE_DUTY)
+    else:
+        # |sawtooth| stretched over [offset - amplitude, offset + amplitude]
+        np.mod(y, 2 * np.pi, out=y)
+        y /= np.pi
+        y -= 1.0
+        np.abs(y, out=y)
+        y *= 2.0
+        y -= 1.0
+    y *= amplitude
+    y += offset
+    return y
+
+
+def analyzed(function_type, frequency, amplitude, offset, samples):
+    # trace of samples points with its min/max pyramid and measurements, run
+    # in the offload pool (so this module must stay free of side effects)
+    time = time_axis(samples)
+    y = synthesize(function_type, frequency, amplitude, offset, time)
+    return y, pyramid.build(y), measure.measure(time, y)